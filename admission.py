@@ -0,0 +1,253 @@
+# admission.py
+"""
+Admission control for the diagnosis path.
+
+admit() runs before the request body is read, so a shed request never
+uploads it (a VCF upload can be large). It only needs the user and the
+request's Content-Length:
+
+1. Size budget: requests larger than max_request_bytes are rejected.
+2. Per-user token buckets: each user may submit `rate_per_minute` requests on
+   average with bursts of up to `burst`.
+3. A bounded number of diagnoses in flight across all worker processes. When
+   it is full, requests are shed immediately (the caller answers 503 +
+   Retry-After) instead of queueing behind slow ones. `reserved_short_slots`
+   of the slots are kept for short requests (at most short_request_bytes), so
+   a burst of uploads or huge notes cannot starve them.
+
+Once admitted, the caller reads the body and checks the symptom text with
+check_input(): texts longer than max_input_chars are rejected.
+
+The buckets and in-flight slots live in a small SQLite file (`state_path`)
+shared by every worker process on the host, so the limits hold for the server
+as a whole rather than per process. Each admission runs in one IMMEDIATE
+transaction, which SQLite serialises across processes; if the state is locked
+for longer than `busy_timeout` the request is shed rather than left waiting.
+A slot records its
+worker's PID, so slots left behind by a worker that died mid-request are
+reclaimed. Without a state_path the state is an in-memory database private
+to the process.
+"""
+import os
+import time
+import math
+import sqlite3
+import threading
+
+DEFAULT_MAX_INPUT_CHARS = 5000
+DEFAULT_MAX_REQUEST_BYTES = 50 * 1024 * 1024
+DEFAULT_RATE_PER_MINUTE = 20
+DEFAULT_BURST = 5
+DEFAULT_MAX_IN_FLIGHT = 4
+DEFAULT_SHORT_REQUEST_BYTES = 2000   # a ~500 character note, form-encoded
+DEFAULT_RESERVED_SHORT_SLOTS = 1
+DEFAULT_RETRY_AFTER = 2         # seconds suggested to shed clients
+DEFAULT_BUSY_TIMEOUT = 0.25     # seconds admit() waits for the shared state before shedding
+RELEASE_BUSY_TIMEOUT = 10.0     # release() waits longer: a lost release holds a slot until reclaimed
+STALE_SLOT_SECONDS = 600        # slots older than this are reclaimed even if their PID is alive
+MAX_TRACKED_USERS = 10_000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS buckets (user_key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL);
+CREATE TABLE IF NOT EXISTS slots (id INTEGER PRIMARY KEY AUTOINCREMENT, pid INTEGER NOT NULL, started REAL NOT NULL);
+"""
+
+
+class TokenBucket:
+    def __init__(self, rate_per_second, capacity, now, tokens=None):
+        self.rate = rate_per_second
+        self.capacity = capacity
+        self.tokens = float(capacity if tokens is None else tokens)
+        self.updated = now
+
+    def refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, now):
+        """Takes one token. Returns 0 on success, else the seconds until one is available."""
+        self.refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+
+class Rejected(Exception):
+    """
+    Raised when a request is not admitted.
+    status: HTTP status to answer with (413, 429 or 503)
+    retry_after: seconds the client should wait, or None
+    """
+
+    def __init__(self, status, message, retry_after=None):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.retry_after = retry_after
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class AdmissionController:
+    def __init__(self, max_input_chars=DEFAULT_MAX_INPUT_CHARS, rate_per_minute=DEFAULT_RATE_PER_MINUTE,
+                 burst=DEFAULT_BURST, max_in_flight=DEFAULT_MAX_IN_FLIGHT,
+                 short_request_bytes=DEFAULT_SHORT_REQUEST_BYTES,
+                 reserved_short_slots=DEFAULT_RESERVED_SHORT_SLOTS, retry_after=DEFAULT_RETRY_AFTER,
+                 state_path=None, max_request_bytes=DEFAULT_MAX_REQUEST_BYTES,
+                 busy_timeout=DEFAULT_BUSY_TIMEOUT):
+        """
+        rate_per_minute: per-user rate; None turns per-user rate limiting off
+            (e.g. for load tests, where synthetic users send back to back)
+        state_path: SQLite file shared by the worker processes; None keeps the
+            state in memory, private to this process
+        """
+        self.max_input_chars = max_input_chars
+        self.max_request_bytes = max_request_bytes
+        self.rate_per_second = rate_per_minute / 60.0 if rate_per_minute else None
+        self.burst = burst
+        self.max_in_flight = max_in_flight
+        self.short_request_bytes = short_request_bytes
+        self.reserved_short_slots = min(reserved_short_slots, max_in_flight)
+        self.retry_after = retry_after
+        self.state_path = state_path
+        self.busy_timeout = busy_timeout
+
+        # One connection per process (reopened after fork), used under the lock
+        self._conn = None
+        self._conn_pid = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config):
+        """Builds a controller from the ADMISSION_* keys of a Flask config (defaults otherwise)."""
+        return cls(
+            max_input_chars=config.get('ADMISSION_MAX_INPUT_CHARS', DEFAULT_MAX_INPUT_CHARS),
+            rate_per_minute=config.get('ADMISSION_RATE_PER_MINUTE', DEFAULT_RATE_PER_MINUTE),
+            burst=config.get('ADMISSION_BURST', DEFAULT_BURST),
+            max_in_flight=config.get('ADMISSION_MAX_IN_FLIGHT', DEFAULT_MAX_IN_FLIGHT),
+            short_request_bytes=config.get('ADMISSION_SHORT_REQUEST_BYTES', DEFAULT_SHORT_REQUEST_BYTES),
+            reserved_short_slots=config.get('ADMISSION_RESERVED_SHORT_SLOTS', DEFAULT_RESERVED_SHORT_SLOTS),
+            retry_after=config.get('ADMISSION_RETRY_AFTER', DEFAULT_RETRY_AFTER),
+            state_path=config.get('ADMISSION_STATE_PATH'),
+            max_request_bytes=config.get('ADMISSION_MAX_REQUEST_BYTES', DEFAULT_MAX_REQUEST_BYTES),
+            busy_timeout=config.get('ADMISSION_BUSY_TIMEOUT', DEFAULT_BUSY_TIMEOUT),
+        )
+
+    def _connection(self):
+        if self._conn is None or self._conn_pid != os.getpid():
+            if self.state_path:
+                os.makedirs(os.path.dirname(os.path.abspath(self.state_path)), exist_ok=True)
+            conn = sqlite3.connect(self.state_path or ":memory:", timeout=self.busy_timeout,
+                                   isolation_level=None, check_same_thread=False)
+            if self.state_path:
+                conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+            self._conn, self._conn_pid = conn, os.getpid()
+        return self._conn
+
+    def _transaction(self, work, busy_timeout=None):
+        """
+        Runs work(conn) in one IMMEDIATE transaction; an exception rolls everything back.
+        Waits up to busy_timeout seconds (default self.busy_timeout) for another
+        process's transaction, then raises sqlite3.OperationalError.
+        """
+        with self._lock:
+            conn = self._connection()
+            timeout = self.busy_timeout if busy_timeout is None else busy_timeout
+            conn.execute(f"PRAGMA busy_timeout = {int(timeout * 1000)}")
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = work(conn)
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+            return result
+
+    @property
+    def in_flight(self):
+        return self._transaction(lambda conn: conn.execute("SELECT COUNT(*) FROM slots").fetchone()[0])
+
+    def _take_token(self, conn, user_id, now):
+        """Takes one of the user's tokens; returns 0 or the seconds until one is available."""
+        user_key = str(user_id)
+        row = conn.execute("SELECT tokens, updated FROM buckets WHERE user_key = ?", (user_key,)).fetchone()
+        if row is None:
+            if conn.execute("SELECT COUNT(*) FROM buckets").fetchone()[0] >= MAX_TRACKED_USERS:
+                # Buckets that have refilled completely carry no state worth keeping
+                conn.execute("DELETE FROM buckets WHERE tokens + (? - updated) * ? >= ?",
+                             (now, self.rate_per_second, self.burst))
+            bucket = TokenBucket(self.rate_per_second, self.burst, now)
+        else:
+            bucket = TokenBucket(self.rate_per_second, self.burst, row[1], tokens=row[0])
+        wait = bucket.take(now)
+        if not wait:
+            conn.execute("INSERT OR REPLACE INTO buckets (user_key, tokens, updated) VALUES (?, ?, ?)",
+                         (user_key, bucket.tokens, bucket.updated))
+        return wait
+
+    def _reclaim_slots(self, conn, now):
+        """Drops slots of workers that died mid-request, or that are implausibly old."""
+        stale = [
+            (slot_id,) for slot_id, pid, started in conn.execute("SELECT id, pid, started FROM slots")
+            if not _pid_alive(pid) or now - started > STALE_SLOT_SECONDS
+        ]
+        conn.executemany("DELETE FROM slots WHERE id = ?", stale)
+
+    def admit(self, user_id, request_bytes):
+        """
+        Runs the size, rate and in-flight checks and takes an in-flight slot.
+        request_bytes is the request's Content-Length (None if unknown, which
+        counts as a long request). Raises Rejected if the request must not run;
+        otherwise returns the slot, which the caller must pass to release() when done.
+        """
+        if request_bytes is not None and request_bytes > self.max_request_bytes:
+            raise Rejected(413, f"The request is too large ({request_bytes // 1024} KiB, "
+                                f"limit {self.max_request_bytes // 1024} KiB).")
+
+        # Wall-clock time: the state is shared between processes
+        now = time.time()
+        is_short = request_bytes is not None and request_bytes <= self.short_request_bytes
+
+        def work(conn):
+            if self.rate_per_second:
+                wait = self._take_token(conn, user_id, now)
+                if wait:
+                    raise Rejected(429, "Too many requests. Please wait a moment and try again.",
+                                   retry_after=math.ceil(wait))
+
+            limit = self.max_in_flight if is_short else self.max_in_flight - self.reserved_short_slots
+            in_flight = conn.execute("SELECT COUNT(*) FROM slots").fetchone()[0]
+            if in_flight >= limit:
+                self._reclaim_slots(conn, now)
+                in_flight = conn.execute("SELECT COUNT(*) FROM slots").fetchone()[0]
+            if in_flight >= limit:
+                # Rolling back also gives the token back: the request was never served
+                raise Rejected(503, "The service is busy. Please try again shortly.",
+                               retry_after=self.retry_after)
+            return conn.execute("INSERT INTO slots (pid, started) VALUES (?, ?)", (os.getpid(), now)).lastrowid
+
+        try:
+            return self._transaction(work)
+        except sqlite3.OperationalError:
+            # Locked for longer than busy_timeout: the server is too busy to even admit
+            raise Rejected(503, "The service is busy. Please try again shortly.", retry_after=self.retry_after)
+
+    def check_input(self, input_chars):
+        """Raises Rejected (413) for symptom texts over the input budget; call once the body is read."""
+        if input_chars > self.max_input_chars:
+            raise Rejected(413, f"Input is too long ({input_chars} characters, "
+                                f"limit {self.max_input_chars}). Please shorten it.")
+
+    def release(self, slot):
+        self._transaction(lambda conn: conn.execute("DELETE FROM slots WHERE id = ?", (slot,)),
+                          busy_timeout=RELEASE_BUSY_TIMEOUT)
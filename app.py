@@ -1,18 +1,31 @@
 # app.py
 import os
-import logging
-from logging.handlers import RotatingFileHandler
-from flask import Flask, render_template, request, redirect, url_for, session, flash
+import threading
+from functools import wraps
+from flask import Flask, render_template, request, redirect, url_for, session, flash, stream_with_context, jsonify, abort
+from flask.logging import default_handler
 from werkzeug.security import generate_password_hash, check_password_hash
 import json
+import datetime
 
 # -------------------------------------------------------------------
 # 1. Local imports from your other modules
 # -------------------------------------------------------------------
-from models import db, User, Diagnosis  # from models.py
+from models import db, User, Diagnosis, add_missing_columns  # from models.py
 from orphanet_parser import load_orphanet_data  # from orphanet_parser.py
-from phrank_pipeline import PhrankPipeline     # from phrank_pipeline.py
-from custom_hpo_extractor import run_custom_extractor  # from custom_hpo_extractor.py
+from phrank_pipeline import PhrankPipeline, DEFAULT_DAG_PATH     # from phrank_pipeline.py
+from custom_hpo_extractor import run_custom_extractor, get_dictionaries, HPO_TERMS_PATH, HPO_SYNONYMS_PATH  # from custom_hpo_extractor.py
+from hpo_extractor import load_hpo_names  # from hpo_extractor.py
+from disease_similarity import DiseaseSimilarityIndex, DEFAULT_INDEX_PATH  # from disease_similarity.py
+from patient_matching import PatientIndex  # from patient_matching.py
+from vcf_genes import genes_from_vcf, load_gene_mapping  # from vcf_genes.py
+from null_model import NullModel, DEFAULT_NULL_MODEL_PATH  # from null_model.py
+from admission import AdmissionController, Rejected  # from admission.py
+from term_filter import TermFilter, DEFAULT_COMMON_PHENOTYPES_PATH  # from term_filter.py
+from diagnosis_export import export_chunks, parse_date, FORMATS  # from diagnosis_export.py
+from response_cache import ResponseCache, normalize_symptoms, knowledge_base_version, diagnosis_etag  # from response_cache.py
+from hpo_suggest import PrefixIndex, term_popularity, DEFAULT_LIMIT  # from hpo_suggest.py
+from structured_logging import configure_logging, init_request_ids, describe_text, StageTimer  # from structured_logging.py
 
 # -------------------------------------------------------------------
 # 2. Flask Application Configuration
@@ -26,6 +39,47 @@ app.config['SECRET_KEY'] = 'REPLACE_ME_WITH_A_SECURE_RANDOM_KEY'
 app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///genomic_diagnostics.db'
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
+# With a null model (see null_model.py), flag "rare/novel" when no top match beats this p-value
+app.config['RARE_PVALUE'] = 0.05
+
+# Weight disease phenotypes by their Orphanet frequency and penalise excluded ones
+app.config['USE_FREQUENCY_WEIGHTS'] = False
+
+# Typo-tolerant second extraction pass over words the exact matcher missed
+app.config['FUZZY_MATCHING'] = False
+
+# Term filtering before ranking (see term_filter.py). TERM_FILTER_COMMON_WEIGHT applies to the
+# terms in data/common_phenotypes.txt: None keeps them, 0 drops them, 0-1 down-weights them
+app.config['TERM_FILTER_COMMON_WEIGHT'] = None
+app.config['TERM_FILTER_MIN_IC'] = 0.0
+app.config['TERM_FILTER_COLLAPSE_ANCESTORS'] = True
+
+# Settings that change diagnosis results, so they are part of the knowledge-base version in API ETags
+KB_SETTINGS = ('USE_FREQUENCY_WEIGHTS', 'FUZZY_MATCHING', 'RARE_PVALUE')
+
+# Bounded cache of /api/diagnose responses, keyed by ETag (see response_cache.py)
+app.config['API_CACHE_MAX_ENTRIES'] = 1024
+app.config['API_CACHE_MAX_BYTES'] = 32 * 1024 * 1024
+
+# Usernames allowed to use the /admin routes (bulk export of all diagnoses)
+app.config['ADMIN_USERNAMES'] = set()
+
+# Admission control for /diagnose (see admission.py); limits hold across all worker
+# processes, whose shared state is kept in ADMISSION_STATE_PATH. A rate of None
+# turns per-user rate limiting off (load tests).
+app.config['ADMISSION_STATE_PATH'] = os.path.join(app.instance_path, 'admission.sqlite')
+app.config['ADMISSION_MAX_INPUT_CHARS'] = 5000
+app.config['ADMISSION_MAX_REQUEST_BYTES'] = 50 * 1024 * 1024
+app.config['ADMISSION_RATE_PER_MINUTE'] = 20
+app.config['ADMISSION_BURST'] = 5
+app.config['ADMISSION_MAX_IN_FLIGHT'] = 4
+app.config['ADMISSION_SHORT_REQUEST_BYTES'] = 2000
+app.config['ADMISSION_RESERVED_SHORT_SLOTS'] = 1
+
+# Any key above can be overridden from the environment as FLASK_<KEY>, with the
+# value parsed as JSON, e.g. FLASK_ADMISSION_RATE_PER_MINUTE=null
+app.config.from_prefixed_env()
+
 db.init_app(app)
 
 # -------------------------------------------------------------------
@@ -34,47 +88,290 @@ db.init_app(app)
 if not os.path.exists('logs'):
     os.mkdir('logs')
 
+# JSON lines written by a background thread; request threads only enqueue records.
+# Flask's default stderr handler is removed, as it would write on the request thread.
 log_file = 'logs/app.log'
-handler = RotatingFileHandler(log_file, maxBytes=1_024*1_024, backupCount=3)
-formatter = logging.Formatter('%(asctime)s [%(levelname)s] %(name)s: %(message)s')
-handler.setFormatter(formatter)
-handler.setLevel(logging.INFO)
-
-app.logger.addHandler(handler)
-app.logger.setLevel(logging.INFO)
+app.logger.removeHandler(default_handler)
+configure_logging(app.logger, log_file)
+init_request_ids(app)
 
 # -------------------------------------------------------------------
-# 4. Initialize DB and Phrank at first request
+# 4. Lazily loaded resources
 # -------------------------------------------------------------------
-@app.before_request
-def create_tables_and_init():
-    db.create_all()  # Creates tables if they don't exist
-    app.logger.info("Database tables ensured.")
+# Nothing heavy is loaded at import time: each resource is built by its get_x()
+# accessor on first use, under `resource_lock`, so concurrent first requests
+# load it once. Servers can call warm_up() to load everything before traffic.
+resource_lock = threading.RLock()
+tables_ready = False
 
-    # Load or parse Orphanet data
-    disease_json = os.path.join("data", "disease_data.json")
-    xml_file = os.path.join("data", "en_product6.xml")
-    disease_data = load_orphanet_data(disease_json, xml_file)
-
-    # Initialize Phrank pipeline
-    hpo_file = os.path.join("data", "hp.obo")
+@app.before_request
+def ensure_tables():
+    global tables_ready
+    if not tables_ready:
+        with resource_lock:
+            if not tables_ready:
+                db.create_all()  # Creates tables if they don't exist
+                add_missing_columns()  # Adds columns introduced after the tables were created
+                tables_ready = True
+                app.logger.info("Database tables ensured.")
+
+phrank_pipeline = None
+
+def get_pipeline():
+    """Loads the Orphanet knowledge base and builds the Phrank pipeline on first use."""
     global phrank_pipeline
-    phrank_pipeline = PhrankPipeline(hpo_file=hpo_file, disease_data=disease_data)
-    app.logger.info("Phrank pipeline initialized with Orphanet data.")
+    if phrank_pipeline is None:
+        with resource_lock:
+            if phrank_pipeline is None:
+                # Load or parse Orphanet data
+                disease_json = os.path.join("data", "disease_data.json")
+                xml_file = os.path.join("data", "en_product6.xml")
+                disease_data = load_orphanet_data(disease_json, xml_file)
+
+                # Gene-aware ranking if a disease-gene file is present
+                disease_gene_file = os.path.join("data", "disease_to_gene.txt")
+                phrank_pipeline = PhrankPipeline(
+                    dag_file=DEFAULT_DAG_PATH,
+                    disease_data=disease_data,
+                    disease_gene_file=disease_gene_file if os.path.exists(disease_gene_file) else None,
+                    use_frequencies=app.config['USE_FREQUENCY_WEIGHTS']
+                )
+                app.logger.info("Phrank pipeline initialized with Orphanet data.")
+    return phrank_pipeline
+
+term_filter = None
+
+def get_term_filter():
+    global term_filter
+    if term_filter is None:
+        with resource_lock:
+            if term_filter is None:
+                term_filter = TermFilter.from_config(get_pipeline(), app.config)
+    return term_filter
+
+null_model = None
+null_model_checked = False
+
+def get_null_model():
+    """
+    Loads the per-disease null score distributions on first use; None if not
+    built yet, or built for other scoring settings (calibration is then off).
+    """
+    global null_model, null_model_checked
+    if not null_model_checked:
+        with resource_lock:
+            if not null_model_checked:
+                if os.path.exists(DEFAULT_NULL_MODEL_PATH):
+                    model = NullModel.load(DEFAULT_NULL_MODEL_PATH)
+                    if model.matches_scoring_mode(get_pipeline(), get_term_filter()):
+                        null_model = model
+                        app.logger.info(f"Loaded null score distributions from {DEFAULT_NULL_MODEL_PATH}.")
+                    else:
+                        app.logger.warning(
+                            f"Ignoring {DEFAULT_NULL_MODEL_PATH}: built for scoring settings {model.scoring_mode}, "
+                            f"not the current ones. Rebuild it with python null_model.py."
+                        )
+                null_model_checked = True
+    return null_model
+
+# Optional "annotated gene name<TAB>knowledge-base gene ID" mapping for VCF uploads
+GENE_MAPPING_FILE = os.path.join("data", "gene_mapping.txt")
+gene_mapping = None
+
+def get_gene_mapping():
+    """Loads the VCF gene mapping on first use; None means annotated IDs are used as-is."""
+    global gene_mapping
+    if gene_mapping is None and os.path.exists(GENE_MAPPING_FILE):
+        with resource_lock:
+            if gene_mapping is None:
+                gene_mapping = load_gene_mapping(GENE_MAPPING_FILE)
+    return gene_mapping
+
+# HPO ID -> display name, used to render score explanations
+hpo_names = None
+
+def get_hpo_names():
+    global hpo_names
+    if hpo_names is None:
+        with resource_lock:
+            if hpo_names is None:
+                hpo_names = load_hpo_names(HPO_TERMS_PATH) if os.path.exists(HPO_TERMS_PATH) else {}
+    return hpo_names
+
+
+kb_version = None
+
+def get_kb_version():
+    """Version of the loaded knowledge base and result-changing settings, used in API ETags."""
+    global kb_version
+    if kb_version is None:
+        with resource_lock:
+            if kb_version is None:
+                kb_version = knowledge_base_version(
+                    [
+                        os.path.join("data", "disease_data.json"),
+                        os.path.join("data", "en_product6.xml"),
+                        DEFAULT_DAG_PATH,
+                        os.path.join("data", "disease_to_gene.txt"),
+                        HPO_TERMS_PATH,
+                        HPO_SYNONYMS_PATH,
+                        app.config.get('TERM_FILTER_COMMON_PATH', DEFAULT_COMMON_PHENOTYPES_PATH),
+                        DEFAULT_NULL_MODEL_PATH,
+                        GENE_MAPPING_FILE,
+                    ],
+                    {key: value for key, value in app.config.items() if key in KB_SETTINGS or key.startswith('TERM_FILTER_')}
+                )
+                app.logger.info(f"Knowledge base version {kb_version}.")
+    return kb_version
+
+response_cache = None
+
+def get_response_cache():
+    global response_cache
+    if response_cache is None:
+        with resource_lock:
+            if response_cache is None:
+                response_cache = ResponseCache(app.config['API_CACHE_MAX_ENTRIES'], app.config['API_CACHE_MAX_BYTES'])
+    return response_cache
+
+
+def warm_up():
+    """
+    Loads every lazily built resource, and returns how long each took
+    ({"<name>_ms": ...}) plus the names of any that failed ("failed": [...]).
+    Call it before serving, e.g. in gunicorn's master before the workers fork
+    (see gunicorn.conf.py) or at startup. A resource that fails to load is
+    logged and skipped; its accessor retries, and reports the error, per request.
+    """
+    timer = StageTimer()
+    failed = []
+    for name, load in [
+        ("dictionaries", get_dictionaries),
+        ("hpo_names", get_hpo_names),
+        ("pipeline", get_pipeline),
+        ("term_filter", get_term_filter),
+        ("null_model", get_null_model),
+        ("similarity_index", get_similarity_index),
+        ("gene_mapping", get_gene_mapping),
+        ("suggest_index", get_suggest_index),
+        ("kb_version", get_kb_version),
+        ("patient_index", warm_patient_index),
+    ]:
+        with timer.stage(name):
+            try:
+                load()
+            except Exception:
+                app.logger.exception(f"Warm-up could not load {name}.")
+                failed.append(name)
+    timings = dict(timer.fields(), failed=failed)
+    if failed:
+        app.logger.warning("Warm-up incomplete", extra={"fields": timings})
+    else:
+        app.logger.info("Warm-up complete", extra={"fields": timings})
+    return timings
+
+
+@app.template_filter('hpo_name')
+def hpo_name_filter(hpo_id):
+    return get_hpo_names().get(hpo_id, hpo_id)
+
+
+@app.template_filter('from_json')
+def from_json_filter(value):
+    return json.loads(value) if value else None
 
 # -------------------------------------------------------------------
 # 5. Decorator for routes that require login
 # -------------------------------------------------------------------
 def login_required(func):
-    from functools import wraps
     @wraps(func)
     def wrapper(*args, **kwargs):
         if 'user_id' not in session:
+            if request.path.startswith('/api/'):
+                return jsonify(error="Please log in first."), 401
             flash("Please log in first.", "warning")
             return redirect(url_for('login'))
         return func(*args, **kwargs)
     return wrapper
 
+def admin_required(func):
+    """Only lets through logged-in users listed in ADMIN_USERNAMES; others get 403."""
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        if 'user_id' not in session:
+            flash("Please log in first.", "warning")
+            return redirect(url_for('login'))
+        if session.get('username') not in app.config['ADMIN_USERNAMES']:
+            app.logger.warning(f"Non-admin user {session.get('username')} tried to access {request.path}")
+            abort(403)
+        return func(*args, **kwargs)
+    return wrapper
+
+def is_admin(user_id):
+    """Whether the user is listed in ADMIN_USERNAMES (for code running outside the session's view)."""
+    if not app.config['ADMIN_USERNAMES']:
+        return False
+    user = db.session.get(User, user_id)
+    return user is not None and user.username in app.config['ADMIN_USERNAMES']
+
+admission = None
+admission_lock = threading.Lock()
+
+def get_admission_controller():
+    global admission
+    if admission is None:
+        with admission_lock:
+            if admission is None:
+                admission = AdmissionController.from_config(app.config)
+    return admission
+
+
+def admission_controlled(func):
+    """
+    Rejects oversized inputs and rate-limited users, and sheds load with
+    503 + Retry-After when too many diagnoses are already running.
+    """
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        controller = get_admission_controller()
+        try:
+            # Before the body is touched, so shed requests are never read (or spooled, for uploads)
+            slot = controller.admit(session.get('user_id'), request.content_length)
+            symptoms = request.form.get('symptoms') if not request.is_json else (request.get_json(silent=True) or {}).get('symptoms')
+            try:
+                controller.check_input(len(symptoms.strip()) if isinstance(symptoms, str) else 0)
+            except Rejected:
+                controller.release(slot)
+                raise
+        except Rejected as r:
+            app.logger.warning(f"Rejected diagnosis for user {session.get('user_id')} ({r.status}): {r.message}")
+            if request.is_json:
+                response = jsonify(error=r.message)
+                response.status_code = r.status
+            elif r.status == 413:
+                flash(r.message, "warning")
+                return redirect(url_for('index'))
+            else:
+                response = app.make_response((
+                    render_template('busy.html', error_code=r.status, error_message=r.message),
+                    r.status
+                ))
+            if r.retry_after:
+                response.headers['Retry-After'] = str(r.retry_after)
+            return response
+        try:
+            response = func(*args, **kwargs)
+        except BaseException:
+            controller.release(slot)
+            raise
+        if getattr(response, 'is_streamed', False):
+            # A streamed body does its work after we return: hold the slot until it is closed
+            response.call_on_close(lambda: controller.release(slot))
+        else:
+            controller.release(slot)
+        return response
+    return wrapper
+
 # -------------------------------------------------------------------
 # 6. Auth Routes (Register, Login, Logout)
 # -------------------------------------------------------------------
@@ -144,63 +441,281 @@ def index():
     return render_template('index.html', username=session.get('username'))
 
 
-@app.route('/diagnose', methods=['POST'])
-@login_required
-def diagnose():
-    user_id = session.get('user_id')
-    user_input = request.form.get('symptoms', '').strip()
+class DiagnosisError(Exception):
+    """A diagnosis that cannot go on; `message` is meant for the user."""
+
+    def __init__(self, message, category="danger"):
+        super().__init__(message)
+        self.message = message
+        self.category = category
+
 
+def diagnosis_events(user_id, user_input, vcf_file=None, patient_genes=None):
+    """
+    Runs one diagnosis and yields (event, payload) pairs as results become available:
+    "terms" once HPO terms are extracted, "provisional" top matches computed from the
+    highest-IC terms only, and "final" with everything the results page shows.
+    Raises DiagnosisError when the diagnosis cannot be completed.
+    patient_genes: candidate genes given directly (the JSON API), used when no VCF is uploaded.
+    The results page, the streaming endpoint and the JSON API all consume this generator.
+    """
     if not user_input:
-        flash("Please enter your symptoms.", "warning")
-        return redirect(url_for('index'))
+        raise DiagnosisError("Please enter your symptoms.", "warning")
 
-    app.logger.info(f"User {user_id} diagnosing. Input: {user_input}")
+    timer = StageTimer()
+    app.logger.info("Diagnosis started", extra={"fields": {"user_id": user_id, **describe_text(user_input)}})
 
     # 1. Extract HPO terms using your custom code
     try:
-        patient_hpo_terms = run_custom_extractor(user_input)
+        with timer.stage("extract"):
+            patient_hpo_terms = run_custom_extractor(user_input, fuzzy=app.config['FUZZY_MATCHING'])
     except Exception as e:
         app.logger.exception("Error in custom HPO extraction.")
-        flash("Error extracting HPO terms. Please try again later.", "danger")
-        return redirect(url_for('index'))
+        raise DiagnosisError("Error extracting HPO terms. Please try again later.")
 
     if not patient_hpo_terms:
-        flash("No HPO terms recognized. Try more detailed symptoms.", "warning")
-        return redirect(url_for('index'))
+        raise DiagnosisError("No HPO terms recognized. Try more detailed symptoms.", "warning")
 
-    # 2. Rank diseases with Phrank
+    # Drop or down-weight non-specific terms and collapse redundant ancestors
+    extracted_count = len(patient_hpo_terms)
     try:
-        results, is_rare = phrank_pipeline.rank_diseases(patient_hpo_terms, threshold=0.2)
+        with timer.stage("filter"):
+            patient_hpo_terms, term_weights = get_term_filter().apply(patient_hpo_terms)
+    except Exception as e:
+        app.logger.exception("Error filtering HPO terms.")
+        raise DiagnosisError("Error performing phenotype matching. Please try again.")
+
+    yield "terms", {
+        "patient_hpo_terms": patient_hpo_terms,
+        "term_names": {term: hpo_name_filter(term) for term in patient_hpo_terms},
+    }
+
+    # 2. Optional VCF upload: restrict ranking to diseases of the patient's candidate genes
+    notices = []
+    uploaded_vcf = bool(vcf_file and vcf_file.filename)
+    if uploaded_vcf or patient_genes is not None:
+        try:
+            gene_map_loaded = bool(get_pipeline().disease_to_genes)
+        except Exception as e:
+            app.logger.exception("Error loading the Phrank pipeline.")
+            raise DiagnosisError("Error performing phenotype matching. Please try again.")
+        if not gene_map_loaded:
+            # Filtering against an empty map would drop every disease
+            raise DiagnosisError(
+                "Gene filtering is unavailable because no disease-gene map is loaded. "
+                "Submit your symptoms without candidate genes.", "warning"
+            )
+    if uploaded_vcf:
+        try:
+            with timer.stage("vcf"):
+                patient_genes = genes_from_vcf(vcf_file.stream, mapping=get_gene_mapping())
+        except Exception as e:
+            app.logger.exception("Error reading VCF upload.")
+            raise DiagnosisError("Could not read the VCF file. Please check its format.")
+        app.logger.info("VCF read", extra={"fields": {"user_id": user_id, "candidate_genes": len(patient_genes)}})
+    if patient_genes is not None and not patient_genes:
+        app.logger.warning("No candidate genes given; ranking without the gene filter.",
+                           extra={"fields": {"user_id": user_id}})
+        notices.append("No candidate genes were found, so diseases were ranked without the gene filter.")
+        patient_genes = None
+
+    # 3. Rank diseases with Phrank, reporting provisional matches on the way
+    try:
+        with timer.stage("rank"):
+            for event, payload in get_pipeline().rank_progressively(
+                patient_hpo_terms, threshold=0.2, patient_genes=patient_genes, top_k=10,
+                term_weights=term_weights
+            ):
+                if event == "provisional":
+                    yield "provisional", {"top_results": payload}
+                else:
+                    results, is_rare, explanations = payload
     except Exception as e:
         app.logger.exception("Error in Phrank pipeline.")
-        flash("Error performing phenotype matching. Please try again.", "danger")
-        return redirect(url_for('index'))
+        raise DiagnosisError("Error performing phenotype matching. Please try again.")
 
     top_results = results[:10]  # show top 10
-    results_json = json.dumps(top_results)
-
-    # 3. Store in DB for user history
+    explanations = {
+        disease: [[term, round(contribution, 3)] for term, contribution in contributions]
+        for disease, contributions in explanations.items()
+    }
+
+    # Calibrate the raw scores against the per-disease null distributions, if built
+    significance = {}
+    model = get_null_model()
+    if model is not None and top_results:
+        # The nulls are indexed by the number of terms before filtering, like extracted_count
+        for disease, score, p_value, z_score in model.annotate(top_results, extracted_count):
+            if p_value is not None:
+                significance[disease] = (p_value, z_score)
+        if significance:
+            is_rare = min(p for p, _ in significance.values()) >= app.config['RARE_PVALUE']
+
+    # 4. Store in DB for user history
     diagnosis_entry = Diagnosis(
         user_id=user_id,
         input_text=user_input,
         hpo_terms=json.dumps(patient_hpo_terms),
-        results=results_json,
+        results=json.dumps(top_results),
+        explanations=json.dumps(explanations),
         is_rare=is_rare
     )
-    db.session.add(diagnosis_entry)
-    db.session.commit()
+    with timer.stage("store"):
+        db.session.add(diagnosis_entry)
+        db.session.commit()
 
-    # 4. Render results page
-    return render_template(
-        'results.html',
-        input_text=user_input,
-        patient_hpo_terms=patient_hpo_terms,
-        top_results=top_results,
-        is_rare=is_rare
+    # 5. Index the diagnoses saved since the last query (including this one and
+    #    other workers'), then find similar past patients among the user's own
+    #    diagnoses (admins search every user's)
+    with timer.stage("match_patients"):
+        index = get_patient_index()
+        index.catch_up()
+        owner_id = None if is_admin(user_id) else user_id
+        matches = index.most_similar(patient_hpo_terms, k=5, exclude=[diagnosis_entry.id], owner_id=owner_id)
+        similar_patients = similar_patient_cases(matches)
+
+    app.logger.info("Diagnosis complete", extra={"fields": {
+        "user_id": user_id,
+        "diagnosis_id": diagnosis_entry.id,
+        "extracted_terms": extracted_count,
+        "hpo_terms": len(patient_hpo_terms),
+        "is_rare": is_rare,
+        **timer.fields()
+    }})
+
+    yield "final", {
+        "diagnosis_id": diagnosis_entry.id,
+        "patient_hpo_terms": patient_hpo_terms,
+        "candidate_genes": len(patient_genes) if patient_genes is not None else None,
+        "top_results": top_results,
+        "is_rare": is_rare,
+        "significance": significance,
+        "explanations": explanations,
+        "term_names": {
+            term: hpo_name_filter(term)
+            for contributions in explanations.values() for term, _ in contributions
+        },
+        "similar_patients": similar_patients,
+        "notices": notices,
+    }
+
+
+@app.route('/diagnose', methods=['POST'])
+@login_required
+@admission_controlled
+def diagnose():
+    user_input = request.form.get('symptoms', '').strip()
+    try:
+        for event, payload in diagnosis_events(session.get('user_id'), user_input, request.files.get('vcf')):
+            pass  # the page is rendered from the final event
+    except DiagnosisError as e:
+        flash(e.message, e.category)
+        return redirect(url_for('index'))
+
+    return render_template('results.html', input_text=user_input, **payload)
+
+
+def format_event(event, payload, sse):
+    if sse:
+        return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+    return json.dumps({"event": event, **payload}) + "\n"
+
+
+@app.route('/diagnose/stream', methods=['POST'])
+@login_required
+@admission_controlled
+def diagnose_stream():
+    """
+    Same diagnosis as /diagnose, streamed as it progresses: newline-delimited JSON
+    by default, Server-Sent Events if the client accepts text/event-stream.
+    """
+    user_id = session.get('user_id')
+    user_input = request.form.get('symptoms', '').strip()
+    sse = request.accept_mimetypes.best_match(['application/x-ndjson', 'text/event-stream']) == 'text/event-stream'
+
+    def generate():
+        try:
+            for event, payload in diagnosis_events(user_id, user_input, request.files.get('vcf')):
+                yield format_event(event, payload, sse)
+        except DiagnosisError as e:
+            yield format_event("error", {"message": e.message, "category": e.category}, sse)
+        except Exception as e:
+            app.logger.exception("Error while streaming a diagnosis.")
+            yield format_event("error", {"message": "Unexpected error. Please try again.", "category": "danger"}, sse)
+
+    return app.response_class(
+        stream_with_context(generate()),
+        mimetype='text/event-stream' if sse else 'application/x-ndjson',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
     )
 
 # -------------------------------------------------------------------
-# 8. History Route
+# 8. JSON Diagnosis API (ETags and caching in response_cache.py)
+# -------------------------------------------------------------------
+@app.route('/api/diagnose', methods=['POST'])
+@login_required
+def api_diagnose():
+    """
+    JSON diagnosis: {"symptoms": "...", "genes": ["..."] (optional)} -> the final
+    result of the same code path as /diagnose (without per-user fields).
+    Responses carry an ETag over the normalized input and the knowledge-base
+    version: If-None-Match gets a 304 without any work, and repeated inputs are
+    answered from a bounded in-memory cache. Cache hits are not stored in the
+    user's history.
+    """
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict) or not isinstance(body.get('symptoms'), str):
+        return jsonify(error='Expected a JSON object with a "symptoms" string.'), 400
+    genes = body.get('genes')
+    if genes is not None and not (isinstance(genes, list) and all(isinstance(g, str) for g in genes)):
+        return jsonify(error='"genes" must be a list of strings.'), 400
+
+    # Stripped like the /diagnose form input; the normalized text only keys the ETag
+    symptoms = body['symptoms'].strip()
+    etag = diagnosis_etag(get_kb_version(), normalize_symptoms(symptoms), genes)
+    if etag.strip('"') in request.if_none_match:
+        response = app.response_class(status=304)
+        response.headers['ETag'] = etag
+        return response
+
+    cache = get_response_cache()
+    cached = cache.get(etag)
+    if cached is None:
+        result = compute_api_diagnosis(symptoms, set(genes) if genes is not None else None)
+        if not isinstance(result, bytes):
+            return result  # rejected by admission control or failed
+        cache.put(etag, result)
+        cached = result
+        cache_status = 'MISS'
+    else:
+        cache_status = 'HIT'
+
+    response = app.response_class(cached, mimetype='application/json')
+    response.headers['ETag'] = etag
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.headers['X-Cache'] = cache_status
+    response.headers['X-Knowledge-Base-Version'] = get_kb_version()
+    return response
+
+
+@admission_controlled
+def compute_api_diagnosis(symptoms, patient_genes):
+    """Runs the diagnosis and returns the serialized API response, or an error response."""
+    try:
+        for event, payload in diagnosis_events(session.get('user_id'), symptoms, patient_genes=patient_genes):
+            pass  # only the final result is returned
+    except DiagnosisError as e:
+        return jsonify(error=e.message), (422 if e.category == "warning" else 500)
+    except Exception:
+        app.logger.exception("Error during an API diagnosis.")
+        return jsonify(error="Unexpected error. Please try again."), 500
+
+    result = {key: value for key, value in payload.items() if key not in ('diagnosis_id', 'similar_patients')}
+    result['knowledge_base_version'] = get_kb_version()
+    return json.dumps(result).encode('utf-8')
+
+# -------------------------------------------------------------------
+# 9. History Route
 # -------------------------------------------------------------------
 @app.route('/history')
 @login_required
@@ -211,7 +726,174 @@ def history():
     return render_template('history.html', diagnoses=user_diagnoses)
 
 # -------------------------------------------------------------------
-# 9. Error Handlers
+# 10. Admin Export (see diagnosis_export.py)
+# -------------------------------------------------------------------
+@app.route('/admin/export')
+@admin_required
+def export_diagnoses():
+    """
+    Streams every diagnosis as ?format=csv|jsonl|parquet, optionally filtered by
+    ?user=<username> (repeatable), ?since=YYYY-MM-DD (inclusive) and ?until=YYYY-MM-DD (exclusive).
+    """
+    fmt = request.args.get('format', 'csv')
+    if fmt not in FORMATS:
+        return f"Unknown format {fmt!r}; use one of {', '.join(sorted(FORMATS))}.", 400
+    try:
+        since = parse_date(request.args.get('since'))
+        until = parse_date(request.args.get('until'))
+    except ValueError:
+        return "Dates must be given as YYYY-MM-DD.", 400
+    usernames = request.args.getlist('user') or None
+
+    try:
+        chunks = export_chunks(fmt, usernames, since, until)
+        first = next(chunks, b"")  # surfaces a missing optional dependency before streaming starts
+    except RuntimeError as e:
+        return str(e), 501
+
+    def generate():
+        yield first
+        yield from chunks
+
+    app.logger.info("Diagnosis export started", extra={"fields": {
+        "admin": session.get('username'), "format": fmt, "users": usernames,
+        "since": since, "until": until
+    }})
+    filename = f"diagnoses-{datetime.date.today().isoformat()}.{fmt}"
+    return app.response_class(
+        stream_with_context(generate()),
+        mimetype=FORMATS[fmt],
+        headers={'Content-Disposition': f'attachment; filename="{filename}"'}
+    )
+
+# -------------------------------------------------------------------
+# 11. Similar Diseases (precomputed by disease_similarity.py)
+# -------------------------------------------------------------------
+similarity_index = None
+similarity_index_checked = False
+
+def get_similarity_index():
+    """
+    Loads the precomputed neighbour lists on first use; None if not built yet,
+    or built for other scoring settings.
+    """
+    global similarity_index, similarity_index_checked
+    if not similarity_index_checked:
+        with resource_lock:
+            if not similarity_index_checked:
+                if os.path.exists(DEFAULT_INDEX_PATH):
+                    index = DiseaseSimilarityIndex.load(DEFAULT_INDEX_PATH)
+                    if index.matches_scoring_mode(get_pipeline()):
+                        similarity_index = index
+                        app.logger.info(f"Loaded disease similarity index from {DEFAULT_INDEX_PATH}.")
+                    else:
+                        app.logger.warning(
+                            f"Ignoring {DEFAULT_INDEX_PATH}: built for scoring settings {index.scoring_mode}, "
+                            f"not the current ones. Rebuild it with python disease_similarity.py."
+                        )
+                similarity_index_checked = True
+    return similarity_index
+
+
+@app.route('/similar/<path:disease_key>')
+@login_required
+def similar_diseases(disease_key):
+    """Show the diseases whose phenotype profiles are closest to disease_key."""
+    index = get_similarity_index()
+    if index is None:
+        flash("Similar-disease lookups are not available yet.", "warning")
+        return redirect(url_for('index'))
+    if disease_key not in index:
+        return render_template('404.html'), 404
+
+    return render_template(
+        'similar.html',
+        disease_key=disease_key,
+        neighbours=index.similar(disease_key, k=20)
+    )
+
+# -------------------------------------------------------------------
+# 12. Patient Matchmaking (see patient_matching.py)
+# -------------------------------------------------------------------
+patient_index = None
+patient_index_lock = threading.Lock()
+
+def get_patient_index():
+    """
+    Builds the index over all stored diagnoses on first use (warm_up() does it
+    before serving); diagnose() catches it up with newer rows before each query.
+    """
+    global patient_index
+    if patient_index is None:
+        with patient_index_lock:
+            if patient_index is None:
+                patient_index = PatientIndex(get_pipeline()).load_from_db()
+                app.logger.info(f"Patient index built over {len(patient_index)} diagnoses.")
+    return patient_index
+
+
+def warm_patient_index():
+    """
+    Builds the patient index, then closes the database connections it used so
+    processes forked afterwards don't share them.
+    """
+    with app.app_context():
+        ensure_tables()
+        get_patient_index()
+        db.engine.dispose()
+
+
+def similar_patient_cases(matches):
+    """Turns (diagnosis_id, score) matches into (case id, HPO terms, score) rows."""
+    if not matches:
+        return []
+    ids = [diagnosis_id for diagnosis_id, _ in matches]
+    hpo_terms = dict(
+        Diagnosis.query.with_entities(Diagnosis.id, Diagnosis.hpo_terms).filter(Diagnosis.id.in_(ids))
+    )
+    return [
+        (diagnosis_id, json.loads(hpo_terms.get(diagnosis_id) or "[]"), score)
+        for diagnosis_id, score in matches
+    ]
+
+# -------------------------------------------------------------------
+# 13. HPO Term Autocomplete (see hpo_suggest.py)
+# -------------------------------------------------------------------
+suggest_index = None
+
+def get_suggest_index():
+    """
+    Builds the prefix index over HPO names and synonyms on first use. Terms are
+    ranked by how many diseases use them; if the knowledge base can't be
+    loaded, autocomplete still works with shorter names first.
+    """
+    global suggest_index
+    if suggest_index is None:
+        with resource_lock:
+            if suggest_index is None:
+                try:
+                    popularity = term_popularity(get_pipeline().disease_closures)
+                except Exception:
+                    app.logger.exception("Knowledge base unavailable; HPO suggestions are ranked by name length.")
+                    popularity = None
+                hpo_dict, synonym_dict = get_dictionaries()
+                suggest_index = PrefixIndex(hpo_dict, synonym_dict, get_hpo_names(), popularity=popularity)
+                app.logger.info(f"HPO suggestion index built over {len(suggest_index)} terms.")
+    return suggest_index
+
+
+@app.route('/api/hpo/suggest')
+@login_required
+def suggest_hpo_terms():
+    """HPO terms matching the typed prefix, most common first (when known): ?q=<prefix>&limit=<n>."""
+    query = request.args.get('q', '')
+    limit = request.args.get('limit', DEFAULT_LIMIT, type=int)
+    response = jsonify(query=query, suggestions=get_suggest_index().suggest(query, limit))
+    response.headers['Cache-Control'] = 'private, max-age=3600'
+    return response
+
+# -------------------------------------------------------------------
+# 14. Error Handlers
 # -------------------------------------------------------------------
 @app.errorhandler(404)
 def page_not_found(e):
@@ -224,8 +906,9 @@ def server_error(e):
     return render_template('500.html'), 500
 
 # -------------------------------------------------------------------
-# 10. Main Entry Point
+# 15. Main Entry Point
 # -------------------------------------------------------------------
 if __name__ == '__main__':
-    # For production, use gunicorn or another WSGI server
+    # For production, use gunicorn or another WSGI server (gunicorn -c gunicorn.conf.py app:app)
+    warm_up()
     app.run(debug=False, host='0.0.0.0', port=8001)
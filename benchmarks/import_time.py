@@ -0,0 +1,88 @@
+# benchmarks/import_time.py
+"""
+Startup-time report.
+
+For each module, a fresh interpreter runs `python -X importtime -c "import <module>"`
+and the report shows the total import time plus the slowest imports it pulled
+in (cumulative microseconds, as printed by -X importtime). Then app.warm_up()
+is timed in-process to show what first use of each lazily loaded resource costs.
+
+Examples:
+  python benchmarks/import_time.py
+  python benchmarks/import_time.py --modules app orphanet_parser --top 15 --no-warm-up
+"""
+import os
+import re
+import sys
+import argparse
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_MODULES = [
+    "app",
+    "orphanet_parser",
+    "custom_hpo_extractor",
+    "phrank_pipeline",
+    "models",
+    "diagnosis_export",
+]
+
+# "import time:       412 |       1234 |   foo.bar"
+_LINE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def import_times(module, python=sys.executable, runs=3):
+    """
+    Imports `module` in a fresh interpreter `runs` times and returns the fastest
+    run as (total_us, [(cumulative_us, self_us, depth, name), ...]).
+    """
+    best = None
+    for _ in range(runs):
+        proc = subprocess.run(
+            [python, "-X", "importtime", "-c", f"import {module}"],
+            cwd=ROOT, capture_output=True, text=True
+        )
+        if proc.returncode != 0:
+            raise RuntimeError(f"import {module} failed:\n{proc.stderr[-2000:]}")
+        entries = []
+        for line in proc.stderr.splitlines():
+            m = _LINE.match(line)
+            if m:
+                self_us, cumulative_us, indent, name = m.groups()
+                entries.append((int(cumulative_us), int(self_us), (len(indent) - 1) // 2, name))
+        total = next((e[0] for e in entries if e[3] == module), sum(e[1] for e in entries))
+        if best is None or total < best[0]:
+            best = (total, entries)
+    return best
+
+
+def report(module, top, runs):
+    total, entries = import_times(module, runs=runs)
+    print(f"\nimport {module}: {total / 1000:.1f} ms ({len(entries)} modules imported)")
+    for cumulative_us, self_us, depth, name in sorted(entries, reverse=True)[1:top + 1]:
+        print(f"  {cumulative_us / 1000:8.1f} ms cumulative  {self_us / 1000:7.1f} ms self  {name}")
+
+
+def warm_up_report():
+    sys.path.insert(0, ROOT)
+    os.chdir(ROOT)
+    from app import warm_up
+    timings = warm_up()
+    print("\napp.warm_up() first-use costs:")
+    for name, ms in timings.items():
+        print(f"  {name:<24} {ms:9.1f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Report import and warm-up times.")
+    parser.add_argument("--modules", nargs="+", default=DEFAULT_MODULES)
+    parser.add_argument("--top", type=int, default=10, help="Slowest imports to list per module")
+    parser.add_argument("--runs", type=int, default=3, help="Imports per module; the fastest is reported")
+    parser.add_argument("--no-warm-up", action="store_true", help="Skip timing app.warm_up()")
+    args = parser.parse_args()
+
+    for module in args.modules:
+        report(module, args.top, args.runs)
+    if not args.no_warm_up:
+        warm_up_report()
@@ -0,0 +1,338 @@
+# benchmarks/loadtest.py
+"""
+Load generator for the diagnosis service.
+
+Registers and logs in synthetic users, then submits symptom texts built from
+HPO names and synonyms to /diagnose at a fixed concurrency, and reports
+throughput, latency percentiles, error rates and SQLite lock contention.
+
+Two modes:
+  client  drive app.py in-process through Flask's test client (default)
+  http    drive a running server, e.g. `gunicorn -w 4 -b :8001 app:app`
+
+Examples:
+  python benchmarks/loadtest.py --requests 500 --concurrency 8
+  python benchmarks/loadtest.py --mode http --url http://127.0.0.1:8001 --duration 60
+
+Synthetic users are named loadtest-<run id>-<n> and their diagnoses are stored
+in whatever database the app is configured with.
+
+Each synthetic user sends back to back, far above the per-user rate limit, so
+most requests would be answered 429. --no-rate-limit turns per-user limiting off
+in client mode; in http mode start the server with it off instead:
+  FLASK_ADMISSION_RATE_PER_MINUTE=null gunicorn -c gunicorn.conf.py app:app
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+import http.cookiejar
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HPO_TERMS_PATH = os.path.join(ROOT, "data", "hpo_term_names.txt")
+HPO_SYNONYMS_PATH = os.path.join(ROOT, "data", "hpo_synonyms.txt")
+LOG_PATH = os.path.join(ROOT, "logs", "app.log")
+
+TEMPLATES = [
+    "Patient presents with {}.",
+    "My child has {}.",
+    "For the last few months I have noticed {}.",
+    "History of {}, no other complaints.",
+    "Examination shows {}.",
+]
+
+
+# -------------------------------------------------------------------
+# Symptom text generation
+# -------------------------------------------------------------------
+def load_phrases():
+    """Returns all HPO names and synonyms (lower-cased, root term excluded)."""
+    phrases = []
+    for path in (HPO_TERMS_PATH, HPO_SYNONYMS_PATH):
+        with open(path) as f:
+            for line in f:
+                parts = line.rstrip("\n").split("\t")
+                if len(parts) == 2 and parts[0].startswith("HP:") and parts[0] != "HP:0000001":
+                    phrases.append(parts[1].lower())
+    return phrases
+
+
+def make_symptom_text(rng, phrases, min_terms, max_terms):
+    picked = rng.sample(phrases, rng.randint(min_terms, max_terms))
+    body = ", ".join(picked[:-1]) + " and " + picked[-1] if len(picked) > 1 else picked[0]
+    return rng.choice(TEMPLATES).format(body)
+
+
+# -------------------------------------------------------------------
+# Transports: each session is one logged-in user
+# -------------------------------------------------------------------
+def redirect_path(location):
+    """Path a redirect points to ("" if none), so absolute and relative Locations compare alike."""
+    return urllib.parse.urlsplit(location or "").path
+
+
+class ClientSession:
+    """Talks to the app in-process through Flask's test client."""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def post(self, path, data):
+        """Returns (status, redirect path)."""
+        response = self.client.post(path, data=data)
+        return response.status_code, redirect_path(response.headers.get("Location"))
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+
+class HttpSession:
+    """Talks to a running server over HTTP, keeping the session cookie."""
+
+    def __init__(self, base_url, timeout):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()),
+            _NoRedirect(),
+        )
+
+    def post(self, path, data):
+        """Returns (status, redirect path)."""
+        body = urllib.parse.urlencode(data).encode()
+        try:
+            with self.opener.open(self.base_url + path, data=body, timeout=self.timeout) as response:
+                response.read()
+                return response.status, ""
+        except urllib.error.HTTPError as e:
+            return e.code, redirect_path(e.headers.get("Location"))
+
+
+# -------------------------------------------------------------------
+# SQLite lock contention
+# -------------------------------------------------------------------
+class LockCounter:
+    """Counts 'database is locked' errors raised through the app's engine."""
+
+    def __init__(self):
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def attach(self, app):
+        from sqlalchemy import event
+        from models import db
+        with app.app_context():
+            event.listen(db.engine, "handle_error", self._on_error)
+
+    def _on_error(self, context):
+        if "database is locked" in str(context.original_exception):
+            with self._lock:
+                self.count += 1
+
+
+def count_locked_in_log(offset):
+    """Counts 'database is locked' lines written to logs/app.log after `offset`."""
+    if not os.path.exists(LOG_PATH):
+        return 0
+    with open(LOG_PATH, errors="replace") as f:
+        f.seek(offset)
+        return sum("database is locked" in line for line in f)
+
+
+# -------------------------------------------------------------------
+# Load generation
+# -------------------------------------------------------------------
+class Stats:
+    def __init__(self):
+        self.latencies = []
+        self.statuses = Counter()
+        self.exceptions = Counter()
+        self.login_redirects = 0
+        self._lock = threading.Lock()
+
+    def record(self, latency, status=None, location="", exception=None):
+        with self._lock:
+            if exception is not None:
+                self.exceptions[type(exception).__name__] += 1
+            else:
+                self.latencies.append(latency)
+                self.statuses[status] += 1
+                if is_login_redirect(status, location):
+                    self.login_redirects += 1
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return float("nan")
+    index = min(len(sorted_values) - 1, int(round(pct / 100.0 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def is_login_redirect(status, location):
+    """The app answers a failed login, and any request without a session, by redirecting to /login."""
+    return 300 <= status < 400 and location.rstrip("/").endswith("/login")
+
+
+def login(session, username, password):
+    session.post("/register", {"username": username, "password": password})
+    status, location = session.post("/login", {"username": username, "password": password})
+    if status != 302 or is_login_redirect(status, location):
+        raise RuntimeError(f"Login failed for {username} (HTTP {status} to {location or 'nowhere'})")
+
+
+def run_user(user_no, args, make_session, phrases, stats, budget, deadline):
+    rng = random.Random(args.seed + user_no)
+    session = make_session()
+    login(session, f"loadtest-{args.run_id}-{user_no}", "loadtest-password")
+
+    while time.perf_counter() < deadline and budget.take():
+        text = make_symptom_text(rng, phrases, args.min_terms, args.max_terms)
+        start = time.perf_counter()
+        try:
+            status, location = session.post("/diagnose", {"symptoms": text})
+        except Exception as e:
+            stats.record(time.perf_counter() - start, exception=e)
+        else:
+            stats.record(time.perf_counter() - start, status=status, location=location)
+
+
+class Budget:
+    """Hands out a fixed number of request slots across threads (None = unlimited)."""
+
+    def __init__(self, total):
+        self.remaining = total
+        self._lock = threading.Lock()
+
+    def take(self):
+        if self.remaining is None:
+            return True
+        with self._lock:
+            if self.remaining <= 0:
+                return False
+            self.remaining -= 1
+            return True
+
+
+def report(stats, elapsed, locked, args):
+    latencies = sorted(stats.latencies)
+    total = len(latencies) + sum(stats.exceptions.values())
+    ok = stats.statuses.get(200, 0)
+    # /diagnose redirects back to the form on warnings (no terms recognized) and on handled errors;
+    # a redirect to /login means the session was lost, so the request never ran: an error
+    redirected = sum(n for code, n in stats.statuses.items() if 300 <= code < 400) - stats.login_redirects
+    failed = (sum(n for code, n in stats.statuses.items() if code >= 400) + stats.login_redirects
+              + sum(stats.exceptions.values()))
+
+    summary = {
+        "mode": args.mode,
+        "concurrency": args.concurrency,
+        "requests": total,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(total / elapsed, 2) if elapsed else 0.0,
+        "ok": ok,
+        "redirected": redirected,
+        "errors": failed,
+        "login_redirects": stats.login_redirects,
+        "error_rate": round(failed / total, 4) if total else 0.0,
+        "latency_ms": {
+            name: round(percentile(latencies, pct) * 1000, 2)
+            for name, pct in (("p50", 50), ("p90", 90), ("p95", 95), ("p99", 99), ("max", 100))
+        },
+        "status_codes": {str(code): n for code, n in sorted(stats.statuses.items())},
+        "exceptions": dict(stats.exceptions),
+        "sqlite_locked_errors": locked,
+    }
+
+    if args.json:
+        print(json.dumps(summary, indent=2))
+        return
+
+    print(f"mode={summary['mode']} concurrency={summary['concurrency']}")
+    print(f"requests:    {total} in {summary['elapsed_s']}s -> {summary['throughput_rps']} req/s")
+    print(f"ok/redirect: {ok} / {redirected}")
+    print(f"errors:      {failed} ({summary['error_rate']:.2%}) {summary['exceptions'] or ''}")
+    if stats.login_redirects:
+        print(f"             {stats.login_redirects} redirected to /login (session lost)")
+    print("latency ms:  " + "  ".join(f"{k}={v}" for k, v in summary["latency_ms"].items()))
+    print(f"status:      {summary['status_codes']}")
+    print(f"sqlite 'database is locked' errors: {locked}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test the /diagnose endpoint.")
+    parser.add_argument("--mode", choices=["client", "http"], default="client")
+    parser.add_argument("--url", default="http://127.0.0.1:8001", help="Base URL in http mode")
+    parser.add_argument("--concurrency", type=int, default=4, help="Simultaneous users")
+    parser.add_argument("--requests", type=int, default=200, help="Total /diagnose requests (0 = until --duration)")
+    parser.add_argument("--duration", type=float, default=0, help="Stop after this many seconds (0 = no limit)")
+    parser.add_argument("--warmup", type=int, default=1, help="Unmeasured requests sent before the run")
+    parser.add_argument("--min-terms", type=int, default=2)
+    parser.add_argument("--max-terms", type=int, default=6)
+    parser.add_argument("--timeout", type=float, default=120.0, help="Per-request timeout in http mode")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--run-id", default=str(int(time.time())))
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    parser.add_argument("--no-rate-limit", action="store_true",
+                        help="Turn off per-user rate limiting (client mode; see the module docstring for http)")
+    args = parser.parse_args(argv)
+
+    if not args.requests and not args.duration:
+        parser.error("one of --requests or --duration is required")
+
+    phrases = load_phrases()
+    lock_counter = None
+    log_offset = os.path.getsize(LOG_PATH) if os.path.exists(LOG_PATH) else 0
+
+    if args.mode == "client":
+        # app.py resolves data/ and logs/ relative to the working directory
+        os.chdir(ROOT)
+        sys.path.insert(0, ROOT)
+        from app import app
+        if args.no_rate_limit:
+            app.config['ADMISSION_RATE_PER_MINUTE'] = None
+        lock_counter = LockCounter()
+        lock_counter.attach(app)
+        make_session = lambda: ClientSession(app)
+    else:
+        if args.no_rate_limit:
+            print("--no-rate-limit only applies in client mode; start the server with "
+                  "FLASK_ADMISSION_RATE_PER_MINUTE=null instead.", file=sys.stderr)
+        make_session = lambda: HttpSession(args.url, args.timeout)
+
+    if args.warmup:
+        rng = random.Random(args.seed - 1)
+        session = make_session()
+        login(session, f"loadtest-{args.run_id}-warmup", "loadtest-password")
+        for _ in range(args.warmup):
+            session.post("/diagnose", {"symptoms": make_symptom_text(rng, phrases, args.min_terms, args.max_terms)})
+
+    stats = Stats()
+    budget = Budget(args.requests or None)
+    start = time.perf_counter()
+    deadline = start + args.duration if args.duration else float("inf")
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        futures = [
+            pool.submit(run_user, n, args, make_session, phrases, stats, budget, deadline)
+            for n in range(args.concurrency)
+        ]
+        for future in futures:
+            future.result()
+    elapsed = time.perf_counter() - start
+
+    locked = lock_counter.count if lock_counter else count_locked_in_log(log_offset)
+    report(stats, elapsed, locked, args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,276 @@
+# benchmarks/memory_report.py
+"""
+Memory budget report for the knowledge base held by every worker.
+
+1. Per loader: each loader runs under tracemalloc, and the report shows the
+   memory it still holds afterwards, its peak while loading, and the deep size
+   of what it returned.
+2. Per structure: deep sizes (objects reachable from the structure, each counted
+   once) of the DAG maps, IC dicts, disease_to_phenotypes, hpo_dict,
+   synonym_dict and, when the Phrank pipeline can be built, its compiled
+   scoring postings and closures.
+3. After fork: a child process reads /proc/self/smaps_rollup right after the
+   fork and again after walking every structure once. Walking is what a request
+   does: reference counting writes to object headers, so pages shared
+   copy-on-write with the parent become private. It is measured with and
+   without gc.freeze() before the fork.
+
+Examples:
+  python benchmarks/memory_report.py
+  python benchmarks/memory_report.py --dag hp_dag.tsv --term-hpo annotations.tsv --max-private-mb 150
+
+--max-private-mb makes the script exit with status 1 when a forked worker's
+private memory after the walk exceeds the budget, so it can guard CI.
+"""
+import os
+import gc
+import sys
+import json
+import time
+import argparse
+import tracemalloc
+from collections import OrderedDict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+MB = 1024 * 1024
+
+DAG_PATH = os.path.join(ROOT, "data", "hp_dag.txt")
+DISEASE_JSON_PATH = os.path.join(ROOT, "data", "disease_data.json")
+ORPHANET_XML_PATH = os.path.join(ROOT, "data", "en_product6.xml")
+HPO_TERMS_PATH = os.path.join(ROOT, "data", "hpo_term_names.txt")
+HPO_SYNONYMS_PATH = os.path.join(ROOT, "data", "hpo_synonyms.txt")
+
+
+# -------------------------------------------------------------------
+# Deep sizes
+# -------------------------------------------------------------------
+def deep_sizeof(obj, seen=None):
+    """
+    Bytes of `obj` plus everything reachable from it through containers,
+    instance __dict__s and numpy buffers. Objects already in `seen` are skipped,
+    so shared objects (interned strings, common IDs) are only counted once.
+    """
+    seen = set() if seen is None else seen
+    total = 0
+    stack = [obj]
+    while stack:
+        current = stack.pop()
+        if id(current) in seen:
+            continue
+        seen.add(id(current))
+        total += sys.getsizeof(current)
+        if isinstance(current, (str, bytes, int, float, bool, type(None))):
+            continue
+        nbytes = getattr(current, "nbytes", None)
+        if isinstance(nbytes, int) and getattr(current, "base", None) is None:
+            total += nbytes  # numpy array owning its buffer
+            continue
+        if isinstance(current, dict):
+            stack.extend(current.keys())
+            stack.extend(current.values())
+        elif isinstance(current, (list, tuple, set, frozenset)):
+            stack.extend(current)
+        elif hasattr(current, "__dict__"):
+            stack.append(vars(current))
+    return total
+
+
+def walk(obj):
+    """Touches every object reachable from `obj` (what serving requests does to refcounts)."""
+    return deep_sizeof(obj)
+
+
+# -------------------------------------------------------------------
+# Loaders
+# -------------------------------------------------------------------
+def measure_loader(name, load):
+    """Runs `load()` under tracemalloc; returns (result, stats dict)."""
+    gc.collect()
+    tracemalloc.start()
+    started = time.perf_counter()
+    before = tracemalloc.get_traced_memory()[0]
+    result = load()
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, {
+        "loader": name,
+        "seconds": round(time.perf_counter() - started, 2),
+        "retained_mb": (retained - before) / MB,
+        "peak_mb": (peak - before) / MB,
+        "deep_mb": deep_sizeof(result) / MB,
+    }
+
+
+def load_knowledge_base(dag_path=DAG_PATH, term_hpo_path=None):
+    """
+    Runs every available loader and returns (structures, loader stats, skipped).
+    structures maps a report name to the loaded object.
+    """
+    from phrank import Phrank
+    from phrank.utils import load_maps, load_term_hpo
+    from orphanet_parser import load_orphanet_data
+    from hpo_extractor import load_hpo_terms, load_synonyms, load_hpo_names
+
+    structures, stats, skipped = OrderedDict(), [], []
+
+    def run(name, load, required_path=None):
+        if required_path and not os.path.exists(required_path):
+            skipped.append(f"{name}: {os.path.relpath(required_path, ROOT)} not found")
+            return None
+        try:
+            result, entry = measure_loader(name, load)
+        except Exception as e:
+            tracemalloc.stop()
+            skipped.append(f"{name}: {type(e).__name__}: {e}")
+            return None
+        stats.append(entry)
+        return result
+
+    maps = run("load_maps", lambda: load_maps(dag_path), dag_path)
+    if maps is not None:
+        structures["child_to_parent"], structures["parent_to_children"] = maps
+
+    if term_hpo_path:
+        term_hpo = run("load_term_hpo", lambda: load_term_hpo(term_hpo_path), term_hpo_path)
+        if term_hpo is not None:
+            structures["term_to_phenotypes"] = term_hpo
+
+    orphanet_source = DISEASE_JSON_PATH if os.path.exists(DISEASE_JSON_PATH) else ORPHANET_XML_PATH
+    disease_data = run("load_orphanet_data",
+                       lambda: load_orphanet_data(DISEASE_JSON_PATH, ORPHANET_XML_PATH), orphanet_source)
+    if disease_data is not None:
+        structures["disease_data"] = disease_data
+        structures["disease_to_phenotypes"] = {k: v["hpo_terms"] for k, v in disease_data.items()}
+
+    hpo_dict = run("load_hpo_terms", lambda: load_hpo_terms(HPO_TERMS_PATH), HPO_TERMS_PATH)
+    if hpo_dict is not None:
+        structures["hpo_dict"] = hpo_dict
+    synonym_dict = run("load_synonyms", lambda: load_synonyms(HPO_SYNONYMS_PATH), HPO_SYNONYMS_PATH)
+    if synonym_dict is not None:
+        structures["synonym_dict"] = synonym_dict
+    hpo_names = run("load_hpo_names", lambda: load_hpo_names(HPO_TERMS_PATH), HPO_TERMS_PATH)
+    if hpo_names is not None:
+        structures["hpo_names"] = hpo_names
+
+    annotations = structures.get("disease_to_phenotypes") or structures.get("term_to_phenotypes")
+    if "child_to_parent" in structures and annotations:
+        ic = run("compute_information_content",
+                 lambda: Phrank.compute_information_content(annotations, structures["child_to_parent"]))
+        if ic is not None:
+            structures["information_content"], structures["marginal_information_content"] = ic
+    else:
+        skipped.append("compute_information_content: needs the DAG and disease annotations")
+
+    if "disease_data" in structures:
+        from app import get_pipeline
+        pipeline = run("PhrankPipeline", get_pipeline)
+        if pipeline is not None:
+            structures["pipeline.disease_closures"] = pipeline.disease_closures
+            structures["pipeline.scoring_postings"] = pipeline._postings
+            structures["pipeline.ancestor_cache"] = pipeline._ancestor_cache
+            structures["pipeline (total)"] = pipeline
+    return structures, stats, skipped
+
+
+# -------------------------------------------------------------------
+# Shared vs private pages after fork
+# -------------------------------------------------------------------
+def smaps_rollup():
+    """kB figures from /proc/self/smaps_rollup (Linux only)."""
+    fields = {}
+    with open("/proc/self/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == "kB":
+                fields[parts[0].rstrip(":")] = int(parts[1])
+    return fields
+
+
+def _page_summary(fields):
+    return {
+        "rss_mb": fields.get("Rss", 0) / 1024,
+        "pss_mb": fields.get("Pss", 0) / 1024,
+        "shared_mb": (fields.get("Shared_Clean", 0) + fields.get("Shared_Dirty", 0)) / 1024,
+        "private_mb": (fields.get("Private_Clean", 0) + fields.get("Private_Dirty", 0)) / 1024,
+    }
+
+
+def measure_after_fork(structures, freeze):
+    """Forks a child that reports its pages right after the fork and after walking `structures`."""
+    if freeze:
+        gc.freeze()
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        try:
+            report = {"after_fork": _page_summary(smaps_rollup())}
+            walk(structures)
+            gc.collect()
+            report["after_walk"] = _page_summary(smaps_rollup())
+            os.write(write_fd, json.dumps(report).encode())
+        finally:
+            os._exit(0)
+    os.close(write_fd)
+    with os.fdopen(read_fd) as pipe:
+        data = pipe.read()
+    os.waitpid(pid, 0)
+    if freeze:
+        gc.unfreeze()
+    return json.loads(data)
+
+
+# -------------------------------------------------------------------
+# Report
+# -------------------------------------------------------------------
+def main():
+    parser = argparse.ArgumentParser(description="Memory budget report for the knowledge base.")
+    parser.add_argument("--dag", default=DAG_PATH, help="child/parent HPO DAG file for load_maps (tab or space separated)")
+    parser.add_argument("--term-hpo", default=None,
+                        help="HPO<TAB>term annotation file to measure load_term_hpo with")
+    parser.add_argument("--max-private-mb", type=float, default=None,
+                        help="Fail if a forked worker's private memory after the walk exceeds this")
+    args = parser.parse_args()
+
+    structures, stats, skipped = load_knowledge_base(args.dag, args.term_hpo)
+
+    print("Loaders (tracemalloc)")
+    print(f"  {'loader':<30} {'seconds':>8} {'retained MB':>12} {'peak MB':>9} {'deep MB':>9}")
+    for s in stats:
+        print(f"  {s['loader']:<30} {s['seconds']:>8.2f} {s['retained_mb']:>12.1f} "
+              f"{s['peak_mb']:>9.1f} {s['deep_mb']:>9.1f}")
+    for reason in skipped:
+        print(f"  skipped {reason}")
+
+    print("\nStructures (deep size, shared objects counted once per structure)")
+    for name, obj in structures.items():
+        count = f"{len(obj):,} entries" if hasattr(obj, "__len__") else ""
+        print(f"  {name:<32} {deep_sizeof(obj) / MB:9.1f} MB  {count}")
+    print(f"  {'all structures together':<32} {deep_sizeof(list(structures.values())) / MB:9.1f} MB")
+
+    if not os.path.exists("/proc/self/smaps_rollup") or not hasattr(os, "fork"):
+        print("\nShared vs private pages: needs Linux (/proc/self/smaps_rollup) and fork().")
+        return 0
+
+    print("\nPages of a forked worker (MB)")
+    print(f"  {'':<30} {'RSS':>8} {'PSS':>8} {'shared':>8} {'private':>8}")
+    worst_private = 0.0
+    for freeze in (False, True):
+        report = measure_after_fork(structures, freeze)
+        for stage in ("after_fork", "after_walk"):
+            p = report[stage]
+            label = f"{'gc.freeze, ' if freeze else ''}{stage.replace('_', ' ')}"
+            print(f"  {label:<30} {p['rss_mb']:>8.1f} {p['pss_mb']:>8.1f} {p['shared_mb']:>8.1f} {p['private_mb']:>8.1f}")
+        worst_private = max(worst_private, report["after_walk"]["private_mb"])
+
+    if args.max_private_mb is not None and worst_private > args.max_private_mb:
+        print(f"\nFAIL: private memory per worker {worst_private:.1f} MB exceeds the "
+              f"{args.max_private_mb:.1f} MB budget.")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,6 +1,7 @@
 # custom_hpo_extractor.py
 import os
 import logging
+import threading
 from hpo_extractor import load_hpo_terms, load_synonyms, extract_hpo_terms_from_text
 
 logger = logging.getLogger(__name__)
@@ -8,24 +9,56 @@ logger = logging.getLogger(__name__)
 HPO_TERMS_PATH = os.path.join("data", "hpo_term_names.txt")
 HPO_SYNONYMS_PATH = os.path.join("data", "hpo_synonyms.txt")
 
-# Load dictionaries at import time so it's done only once
-try:
-    hpo_dict = load_hpo_terms(HPO_TERMS_PATH)
-    synonym_dict = load_synonyms(HPO_SYNONYMS_PATH)
-    logger.info("Loaded HPO terms and synonyms successfully.")
-except Exception as e:
-    logger.exception("Failed to load HPO data.")
-    # Fallback to empty dictionaries if something goes wrong
-    hpo_dict = {}
-    synonym_dict = {}
-
-def run_custom_extractor(text: str) -> list:
+# Dictionaries are loaded on first use (not at import), once per process
+_dictionaries = None
+_dictionaries_lock = threading.Lock()
+
+
+def get_dictionaries():
+    """Returns (hpo_dict, synonym_dict), loading them on the first call."""
+    global _dictionaries
+    if _dictionaries is None:
+        with _dictionaries_lock:
+            if _dictionaries is None:
+                try:
+                    _dictionaries = (load_hpo_terms(HPO_TERMS_PATH), load_synonyms(HPO_SYNONYMS_PATH))
+                    logger.info("Loaded HPO terms and synonyms successfully.")
+                except Exception as e:
+                    logger.exception("Failed to load HPO data.")
+                    # Fallback to empty dictionaries if something goes wrong
+                    _dictionaries = ({}, {})
+    return _dictionaries
+
+
+# Trigram index for typo-tolerant matching, built on first fuzzy request
+_fuzzy_index = None
+_fuzzy_index_lock = threading.Lock()
+
+
+def get_fuzzy_index():
+    global _fuzzy_index
+    if _fuzzy_index is None:
+        with _fuzzy_index_lock:
+            if _fuzzy_index is None:
+                from fuzzy_matcher import TrigramIndex
+                _fuzzy_index = TrigramIndex(*get_dictionaries())
+                logger.info("Built trigram index over %d HPO phrases.", len(_fuzzy_index.phrases))
+    return _fuzzy_index
+
+
+def run_custom_extractor(text: str, fuzzy: bool = False) -> list:
     """
     Uses your custom HPO extraction to get HPO IDs from plain-English input.
+    With fuzzy=True, words the exact matcher missed are also matched with
+    typo tolerance ("siezure" -> seizure).
     Returns a list of unique HPO IDs.
     """
     try:
+        hpo_dict, synonym_dict = get_dictionaries()
         matches = extract_hpo_terms_from_text(text, hpo_dict, synonym_dict)
+        if fuzzy:
+            from fuzzy_matcher import match_missed_spans
+            matches += match_missed_spans(text, get_fuzzy_index(), [m[1] for m in matches])
         # 'matches' is a list of (hpo_id, matched_term)
         # We only need the HPO IDs in a unique set
         hpo_ids = list({m[0] for m in matches})
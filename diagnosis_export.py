@@ -0,0 +1,175 @@
+# diagnosis_export.py
+"""
+Streaming bulk export of stored diagnoses as CSV, JSON lines or Parquet.
+
+Rows are read through a server-side cursor in batches of `batch_size`
+(stream_results + yield_per), and every format is produced as a generator of
+byte chunks, so an export of millions of rows runs in constant memory and can
+be sent as a streamed HTTP response or written to a file.
+
+Parquet needs the optional pyarrow package (imported only when a Parquet export
+runs); each batch becomes one row group.
+"""
+import io
+import csv
+import sys
+import json
+import argparse
+import datetime
+
+DEFAULT_BATCH_SIZE = 1000
+FORMATS = {
+    "csv": "text/csv",
+    "jsonl": "application/x-ndjson",
+    "parquet": "application/vnd.apache.parquet",
+}
+COLUMNS = ["id", "user_id", "username", "created_at", "input_text",
+           "hpo_terms", "results", "explanations", "is_rare"]
+JSON_COLUMNS = ("hpo_terms", "results", "explanations")
+
+
+def parse_date(value):
+    """YYYY-MM-DD (or a full ISO timestamp) -> datetime; None passes through."""
+    if not value:
+        return None
+    return datetime.datetime.fromisoformat(value)
+
+
+def export_query(usernames=None, since=None, until=None):
+    """
+    Diagnoses joined with their user, oldest first. `since` is inclusive and
+    `until` exclusive. Needs an app context.
+    """
+    from models import db, User, Diagnosis
+    query = (
+        db.session.query(
+            Diagnosis.id, Diagnosis.user_id, User.username, Diagnosis.created_at, Diagnosis.input_text,
+            Diagnosis.hpo_terms, Diagnosis.results, Diagnosis.explanations, Diagnosis.is_rare
+        )
+        .join(User, User.id == Diagnosis.user_id)
+        .order_by(Diagnosis.id)
+    )
+    if usernames:
+        query = query.filter(User.username.in_(usernames))
+    if since is not None:
+        query = query.filter(Diagnosis.created_at >= since)
+    if until is not None:
+        query = query.filter(Diagnosis.created_at < until)
+    return query
+
+
+def iter_rows(query, batch_size=DEFAULT_BATCH_SIZE):
+    """Yields one dict per diagnosis, fetching `batch_size` rows at a time from a server-side cursor."""
+    rows = query.execution_options(stream_results=True).yield_per(batch_size)
+    for row in rows:
+        record = dict(zip(COLUMNS, row))
+        if record["created_at"] is not None:
+            record["created_at"] = record["created_at"].isoformat()
+        yield record
+
+
+def _batched(rows, batch_size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def csv_chunks(rows, batch_size=DEFAULT_BATCH_SIZE):
+    """CSV with a header row; JSON columns are kept as their stored JSON text."""
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=COLUMNS)
+    writer.writeheader()
+    for batch in _batched(rows, batch_size):
+        writer.writerows(batch)
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+
+def jsonl_chunks(rows, batch_size=DEFAULT_BATCH_SIZE):
+    """One JSON object per line; JSON columns are decoded into nested values."""
+    for batch in _batched(rows, batch_size):
+        lines = []
+        for row in batch:
+            for column in JSON_COLUMNS:
+                row[column] = json.loads(row[column]) if row[column] else None
+            lines.append(json.dumps(row))
+        yield ("\n".join(lines) + "\n").encode("utf-8")
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file that hands out whatever was written since the last drain()."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def parquet_chunks(rows, batch_size=DEFAULT_BATCH_SIZE):
+    """Parquet file, one row group per batch. JSON columns stay JSON text."""
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError("Parquet export needs the pyarrow package.")
+    schema = pa.schema([
+        ("id", pa.int64()), ("user_id", pa.int64()), ("username", pa.string()),
+        ("created_at", pa.string()), ("input_text", pa.string()), ("hpo_terms", pa.string()),
+        ("results", pa.string()), ("explanations", pa.string()), ("is_rare", pa.bool_()),
+    ])
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, schema, compression="zstd")
+    for batch in _batched(rows, batch_size):
+        writer.write_table(pa.Table.from_pylist(batch, schema=schema))
+        yield sink.drain()
+    writer.close()
+    yield sink.drain()
+
+
+WRITERS = {"csv": csv_chunks, "jsonl": jsonl_chunks, "parquet": parquet_chunks}
+
+
+def export_chunks(fmt, usernames=None, since=None, until=None, batch_size=DEFAULT_BATCH_SIZE):
+    """Byte chunks of the filtered export in `fmt` ("csv", "jsonl" or "parquet"). Needs an app context."""
+    rows = iter_rows(export_query(usernames, since, until), batch_size)
+    return WRITERS[fmt](rows, batch_size)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export stored diagnoses.")
+    parser.add_argument("--format", choices=sorted(FORMATS), default="jsonl")
+    parser.add_argument("--out", default=None, help="Output file (default: stdout)")
+    parser.add_argument("--user", action="append", dest="usernames", help="Only this username (repeatable)")
+    parser.add_argument("--since", type=parse_date, help="Only diagnoses on or after this date")
+    parser.add_argument("--until", type=parse_date, help="Only diagnoses before this date")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    args = parser.parse_args()
+
+    from app import app
+
+    out = open(args.out, "wb") if args.out else sys.stdout.buffer
+    try:
+        with app.app_context():
+            for chunk in export_chunks(args.format, args.usernames, args.since, args.until, args.batch_size):
+                out.write(chunk)
+    finally:
+        if args.out:
+            out.close()
@@ -0,0 +1,166 @@
+# disease_similarity.py
+"""
+Precomputed "similar diseases" lookups.
+
+The offline build scores every pair of Orphanet diseases with the ranking's
+own compiled scorer and keeps only the top-N neighbours of each disease.
+Written as a matrix product, S = A @ W.T where A is the disease x term
+incidence matrix of the closures and W the compiled per-disease term
+contributions (the marginal IC, frequency-weighted when the pipeline is), so
+S[a, b] is the score disease b gets for a patient presenting all of a's
+phenotypes. S is computed in row/column blocks so each block fits in cache and
+never materialises the full D x D matrix; row blocks are spread across processes.
+
+The index records the pipeline's scoring mode; a server scoring differently
+refuses the file (see matches_scoring_mode).
+
+Build:   python disease_similarity.py --top-n 50 --workers 4
+Lookup:  DiseaseSimilarityIndex.load(path).similar(disease_key, k=10)
+"""
+import os
+import json
+import time
+import argparse
+import numpy as np
+from parallel_blocks import fill_blocks
+
+DEFAULT_INDEX_PATH = os.path.join("data", "disease_similarity.npz")
+DEFAULT_TOP_N = 50
+DEFAULT_BLOCK_SIZE = 256
+
+
+def incidence_matrix(closures, terms):
+    """
+    0/1 matrix (len(closures) x len(terms), float32) of the given ancestor-closed
+    profiles; profile terms outside `terms` are left out.
+    """
+    column = {t: i for i, t in enumerate(terms)}
+    matrix = np.zeros((len(closures), len(terms)), dtype=np.float32)
+    for row, profile in enumerate(closures):
+        cols = [column[t] for t in profile if t in column]
+        matrix[row, cols] = 1.0
+    return matrix
+
+
+def top_n_for_rows(query_rows, matrix, row_offset, top_n, block_size, exclude_self=True):
+    """
+    Scores `query_rows` (patient-style profiles) against every row of `matrix`
+    (compiled disease weights), one block of rows at a time, keeping a running
+    top-N. Returns (neighbour indices, scores), both sorted by descending score.
+    """
+    n_rows = query_rows.shape[0]
+    top_n = min(top_n, matrix.shape[0])
+    best_scores = np.full((n_rows, top_n), -np.inf, dtype=np.float32)
+    best_index = np.full((n_rows, top_n), -1, dtype=np.int32)
+    local_rows = np.arange(n_rows)
+
+    for start in range(0, matrix.shape[0], block_size):
+        block = matrix[start:start + block_size]
+        scores = query_rows @ block.T
+        if exclude_self:
+            own = local_rows + row_offset - start
+            mask = (own >= 0) & (own < block.shape[0])
+            scores[local_rows[mask], own[mask]] = -np.inf
+
+        candidates = np.concatenate([best_scores, scores], axis=1)
+        candidate_index = np.concatenate(
+            [best_index, np.broadcast_to(np.arange(start, start + block.shape[0], dtype=np.int32), scores.shape)],
+            axis=1,
+        )
+        keep = np.argpartition(-candidates, top_n - 1, axis=1)[:, :top_n]
+        best_scores = np.take_along_axis(candidates, keep, axis=1)
+        best_index = np.take_along_axis(candidate_index, keep, axis=1)
+
+    order = np.argsort(-best_scores, axis=1, kind="stable")
+    return np.take_along_axis(best_index, order, axis=1), np.take_along_axis(best_scores, order, axis=1)
+
+
+def _score_row_block(start, state):
+    rows = state["queries"][start:start + state["block_size"]]
+    index, scores = top_n_for_rows(rows, state["matrix"], start, state["top_n"], state["block_size"])
+    return start, index, scores
+
+
+def all_pairs_top_n(queries, matrix, top_n=DEFAULT_TOP_N, block_size=DEFAULT_BLOCK_SIZE, workers=None):
+    """
+    Top-N best-scoring rows of `matrix` for every row of `queries` (row i of
+    both is the same disease, which is excluded). Row blocks are scored in
+    parallel when workers > 1.
+    """
+    n = matrix.shape[0]
+    top_n = min(top_n, max(n - 1, 1))
+    neighbors = np.empty((n, top_n), dtype=np.int32)
+    scores = np.empty((n, top_n), dtype=np.float32)
+    state = {"queries": queries, "matrix": matrix, "top_n": top_n, "block_size": block_size}
+    fill_blocks(_score_row_block, state, range(0, n, block_size), neighbors, scores, workers)
+    return neighbors, scores
+
+
+def build_similarity_index(pipeline, top_n=DEFAULT_TOP_N, block_size=DEFAULT_BLOCK_SIZE, workers=None):
+    """Computes the top-N neighbour lists for every disease in a PhrankPipeline."""
+    keys = pipeline.disease_keys
+    terms = pipeline.scoring_terms()
+    queries = incidence_matrix([pipeline.disease_closures[k] for k in keys], terms)
+    neighbors, scores = all_pairs_top_n(queries, pipeline.weight_matrix(terms), top_n, block_size, workers)
+    return DiseaseSimilarityIndex(keys, neighbors, scores, pipeline.scoring_mode())
+
+
+class DiseaseSimilarityIndex:
+    """Top-N neighbour list per disease, loaded into memory for fast lookups."""
+
+    def __init__(self, keys, neighbors, scores, scoring_mode=None):
+        self.keys = list(keys)
+        self.neighbors = neighbors
+        self.scores = scores
+        self.scoring_mode = scoring_mode  # None for files written before it was recorded
+        self._row = {key: i for i, key in enumerate(self.keys)}
+
+    def matches_scoring_mode(self, pipeline):
+        return self.scoring_mode == pipeline.scoring_mode()
+
+    def __contains__(self, disease_key):
+        return disease_key in self._row
+
+    def similar(self, disease_key, k=10):
+        """
+        Returns up to k (disease_key, score) pairs most similar to disease_key,
+        best first. Unknown diseases return an empty list.
+        """
+        row = self._row.get(disease_key)
+        if row is None:
+            return []
+        return [
+            (self.keys[j], float(s))
+            for j, s in zip(self.neighbors[row, :k], self.scores[row, :k])
+            if j >= 0 and s > 0
+        ]
+
+    def save(self, path):
+        np.savez_compressed(path, keys=np.array(self.keys), neighbors=self.neighbors, scores=self.scores,
+                            scoring_mode=np.array(json.dumps(self.scoring_mode)))
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as data:
+            scoring_mode = json.loads(data["scoring_mode"].item()) if "scoring_mode" in data.files else None
+            return cls(data["keys"].tolist(), data["neighbors"], data["scores"], scoring_mode)
+
+
+if __name__ == "__main__":
+    from app import get_pipeline
+
+    parser = argparse.ArgumentParser(description="Precompute the disease-disease similarity index.")
+    parser.add_argument("--out", default=DEFAULT_INDEX_PATH)
+    parser.add_argument("--top-n", type=int, default=DEFAULT_TOP_N)
+    parser.add_argument("--block-size", type=int, default=DEFAULT_BLOCK_SIZE)
+    parser.add_argument("--workers", type=int, default=None, help="Processes (default: all cores)")
+    args = parser.parse_args()
+
+    # The server's pipeline, so the index is built with the scoring settings it serves with
+    pipeline = get_pipeline()
+
+    started = time.time()
+    index = build_similarity_index(pipeline, args.top_n, args.block_size, args.workers)
+    index.save(args.out)
+    print(f"Wrote top-{args.top_n} neighbours for {len(index.keys)} diseases to {args.out} "
+          f"in {time.time() - started:.1f}s.")
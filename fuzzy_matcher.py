@@ -0,0 +1,171 @@
+# fuzzy_matcher.py
+"""
+Typo-tolerant phenotype matching ("siezure", "microcephally").
+
+A character-trigram index over all HPO names and synonyms narrows each query
+phrase down to the few dictionary phrases that share enough trigrams to be
+within the allowed edit distance (q-gram lemma), and only those candidates
+are verified with a banded Damerau-Levenshtein distance. Counting shared
+trigrams is one numpy bincount over the query's posting lists, so a lookup
+costs about a millisecond instead of a scan over ~43k phrases.
+
+match_missed_spans() runs as a second pass after the exact substring matcher:
+it only looks at word n-grams the exact pass did not cover and that contain
+at least one word unknown to the HPO vocabulary (i.e. a likely typo).
+"""
+import re
+import numpy as np
+from collections import defaultdict
+
+MIN_PHRASE_CHARS = 5   # shorter spans are too ambiguous to correct
+MAX_SPAN_WORDS = 5
+
+_WORD = re.compile(r"[a-z0-9]+")
+
+STOPWORDS = frozenset("""
+a an and are as at be but by for from had has have he her his i in is it its my no not
+of on or our she so than that the their them then there they this to was we were with
+you your patient patients child has history shows also very some""".split())
+
+
+def trigrams(phrase):
+    padded = f"  {phrase} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def max_distance_for(length):
+    """Edits allowed for a phrase of this length: 1 up to 8 characters, 2 beyond."""
+    return 1 if length <= 8 else 2
+
+
+def edit_distance(a, b, limit):
+    """
+    Optimal-string-alignment distance (Levenshtein plus adjacent transpositions),
+    or limit + 1 as soon as it is known to exceed limit. Only the diagonal band
+    of width 2 * limit + 1 is filled in, since cells outside it exceed limit.
+    """
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    over = limit + 1
+    n = len(b)
+    previous2 = None
+    previous = [j if j <= limit else over for j in range(n + 1)]
+    for i in range(1, len(a) + 1):
+        current = [over] * (n + 1)
+        if i <= limit:
+            current[0] = i
+        low, high = max(1, i - limit), min(n, i + limit)
+        row_min = current[0]
+        ai = a[i - 1]
+        for j in range(low, high + 1):
+            bj = b[j - 1]
+            value = previous[j - 1] if ai == bj else previous[j - 1] + 1
+            if previous[j] + 1 < value:
+                value = previous[j] + 1
+            if current[j - 1] + 1 < value:
+                value = current[j - 1] + 1
+            if i > 1 and j > 1 and ai == b[j - 2] and a[i - 2] == bj and previous2[j - 2] + 1 < value:
+                value = previous2[j - 2] + 1
+            current[j] = value if value < over else over
+            if value < row_min:
+                row_min = value
+        if row_min > limit:
+            return over
+        previous2, previous = previous, current
+    return previous[n]
+
+
+class TrigramIndex:
+    def __init__(self, hpo_dict, synonym_dict):
+        """hpo_dict / synonym_dict: lower-cased phrase -> HPO ID (as loaded by hpo_extractor)."""
+        phrase_to_id = dict(synonym_dict)
+        phrase_to_id.update(hpo_dict)
+        self.phrases = list(phrase_to_id)
+        self.hpo_ids = [phrase_to_id[p] for p in self.phrases]
+        self.lengths = np.array([len(p) for p in self.phrases], dtype=np.int32)
+        self.trigram_counts = np.array([len(trigrams(p)) for p in self.phrases], dtype=np.int32)
+        self.vocabulary = frozenset(w for p in self.phrases for w in _WORD.findall(p))
+
+        postings = defaultdict(list)
+        for phrase_id, phrase in enumerate(self.phrases):
+            for gram in trigrams(phrase):
+                postings[gram].append(phrase_id)
+        self._postings = {gram: np.array(ids, dtype=np.int32) for gram, ids in postings.items()}
+
+    def lookup(self, phrase, max_distance=None):
+        """
+        Returns [(hpo_id, dictionary phrase, distance), ...] within max_distance
+        edits of `phrase`, closest first.
+        """
+        phrase = phrase.lower().strip()
+        if max_distance is None:
+            max_distance = max_distance_for(len(phrase))
+        grams = trigrams(phrase)
+        lists = [self._postings[g] for g in grams if g in self._postings]
+        if not lists:
+            return []
+
+        shared = np.bincount(np.concatenate(lists), minlength=len(self.phrases))
+        # q-gram lemma: an edit destroys at most 3 trigrams (4 for a transposition)
+        lost = 4 * max_distance
+        candidates = np.flatnonzero(shared >= max(len(grams) - lost, 1))
+        candidates = candidates[
+            (shared[candidates] >= self.trigram_counts[candidates] - lost)
+            & (np.abs(self.lengths[candidates] - len(phrase)) <= max_distance)
+        ]
+
+        matches = []
+        for phrase_id in candidates:
+            candidate = self.phrases[phrase_id]
+            distance = edit_distance(phrase, candidate, max_distance)
+            if distance <= max_distance:
+                matches.append((self.hpo_ids[phrase_id], candidate, distance))
+        matches.sort(key=lambda m: (m[2], -len(m[1])))
+        return matches
+
+
+def _covered_chars(text, exact_phrases):
+    """Marks the characters of whole-word occurrences of the exact matches."""
+    covered = bytearray(len(text))
+    for phrase in exact_phrases:
+        for m in re.finditer(r"(?<![a-z0-9])" + re.escape(phrase) + r"(?![a-z0-9])", text):
+            covered[m.start():m.end()] = b"\x01" * (m.end() - m.start())
+    return covered
+
+
+def match_missed_spans(text, index, exact_phrases=(), max_span_words=MAX_SPAN_WORDS):
+    """
+    Fuzzy-matches word n-grams of `text` not covered by `exact_phrases`
+    (the phrases the exact matcher already found). Longer spans win and
+    matched spans never overlap. Returns [(hpo_id, dictionary phrase), ...].
+    """
+    text = text.lower()
+    covered = _covered_chars(text, exact_phrases)
+    words = [m for m in _WORD.finditer(text) if not any(covered[m.start():m.end()])]
+
+    taken = set()
+    matches = []
+    for n in range(max_span_words, 0, -1):
+        for i in range(len(words) - n + 1):
+            span_words = words[i:i + n]
+            positions = range(i, i + n)
+            if taken.intersection(positions):
+                continue
+            # Only contiguous words, and only spans that contain a probable typo
+            if any(text[a.end():b.start()].strip(" -") for a, b in zip(span_words, span_words[1:])):
+                continue
+            tokens = [w.group() for w in span_words]
+            if tokens[0] in STOPWORDS or tokens[-1] in STOPWORDS:
+                continue
+            if all(t in index.vocabulary for t in tokens):
+                continue
+            span = " ".join(tokens)
+            if len(span) < MIN_PHRASE_CHARS:
+                continue
+
+            found = index.lookup(span)
+            if found:
+                hpo_id, phrase, _ = found[0]
+                matches.append((hpo_id, phrase))
+                taken.update(positions)
+    return matches
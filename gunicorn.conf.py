@@ -0,0 +1,47 @@
+# gunicorn.conf.py
+"""
+gunicorn -c gunicorn.conf.py app:app
+
+The app is imported once in the master (preload_app) and warmed up there,
+so every forked worker starts with the knowledge base, dictionaries and
+indexes already loaded and shares their pages copy-on-write. Anything that
+fails to load is logged and left to load (or fail) per request in the
+workers. After warm-up the master freezes the garbage collector, so the
+workers' collections don't touch (and copy) those long-lived objects.
+Database connections are only opened by the workers themselves.
+
+Threads don't survive a fork: each worker starts its own log listener in
+post_fork and flushes it in worker_exit.
+"""
+import gc
+
+bind = "0.0.0.0:8001"
+workers = 4
+preload_app = True
+
+
+def _log_handlers():
+    from app import app
+    from structured_logging import DroppingQueueHandler
+    return [h for h in app.logger.handlers if isinstance(h, DroppingQueueHandler)]
+
+
+def when_ready(server):
+    from app import warm_up
+    timings = warm_up()
+    gc.freeze()
+    server.log.info(f"App warmed up in {timings['total_ms']:.0f} ms")
+    if timings["failed"]:
+        server.log.warning(f"Not loaded (retried per request): {', '.join(timings['failed'])}")
+
+
+def post_fork(server, worker):
+    from app import app
+    for handler in _log_handlers():
+        handler.start()
+    app.logger.info("Worker started", extra={"fields": {"pid": worker.pid}})
+
+
+def worker_exit(server, worker):
+    for handler in _log_handlers():
+        handler.stop()
@@ -13,6 +13,19 @@ def load_hpo_terms(file_path):
     return hpo_dict
 
 
+def load_hpo_names(file_path):
+    """
+    Reads hpo_term_names.txt and returns a dictionary mapping HPO IDs to their display names.
+    """
+    hpo_names = {}  # { "HP:0001234": "Phenotype Name" }
+    with open(file_path, "r") as file:
+        for line in file:
+            parts = line.strip().split("\t")
+            if len(parts) == 2:
+                hpo_names[parts[0]] = parts[1]
+    return hpo_names
+
+
 def load_synonyms(file_path):
     """
     Reads hpo_synonyms.txt and returns a dictionary mapping synonyms to HPO IDs.
@@ -20,9 +33,10 @@ def load_synonyms(file_path):
     synonym_dict = {}  # { "synonym": "HP:0001234" }
     with open(file_path, "r") as file:
         for line in file:
-            parts = line.strip().split("\t")  # Format: Synonym<TAB>HPO_ID
+            parts = line.strip().split("\t")  # Format: Synonym<TAB>HPO_ID (or HPO_ID<TAB>Synonym)
             if len(parts) == 2:
-                synonym_dict[parts[0].lower()] = parts[1]
+                synonym, hpo_id = (parts[1], parts[0]) if parts[0].startswith("HP:") else parts
+                synonym_dict[synonym.lower()] = hpo_id
     return synonym_dict
 
 
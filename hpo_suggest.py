@@ -0,0 +1,138 @@
+# hpo_suggest.py
+"""
+Prefix index for HPO term autocomplete.
+
+Every HPO name and synonym contributes one key per word start ("focal
+seizures" is stored as "focal seizures" and "seizures"), so typing any word
+of a phrase finds it. Keys are kept in one sorted list; a query is two
+bisections giving the range of keys that start with it, and the terms in
+that range are picked best-first with numpy.
+
+Terms whose name or synonym starts with the query come first, then terms
+where a later word does. Within each group terms are ranked by popularity (how
+many diseases are annotated with the term or a descendant of it, i.e. low
+information content first), then by shorter name. Rows are numbered in that
+order, so the best matches in a key range are simply its smallest distinct
+rows. Short prefixes with very large ranges ("a", "abn") are answered from
+results computed once up front.
+"""
+import re
+from bisect import bisect_left
+from collections import Counter
+import numpy as np
+
+DEFAULT_LIMIT = 10
+MAX_LIMIT = 25
+LARGE_RANGE = 1024   # key ranges at least this big get their results precomputed
+
+_SPACES = re.compile(r"\s+")
+_WORD_START = re.compile(r"(?<![a-z0-9])[a-z0-9]")
+
+
+def normalize(query):
+    return _SPACES.sub(" ", query.lower()).strip()
+
+
+def term_popularity(disease_closures):
+    """HPO ID -> number of diseases whose ancestor-closed profile contains it."""
+    counts = Counter()
+    for closure in disease_closures.values():
+        counts.update(closure)
+    return counts
+
+
+class PrefixIndex:
+    def __init__(self, hpo_dict, synonym_dict, hpo_names, popularity=None):
+        """
+        hpo_dict / synonym_dict: lower-cased phrase -> HPO ID (as loaded by hpo_extractor)
+        hpo_names: HPO ID -> display name
+        popularity: optional HPO ID -> count used for ranking (see term_popularity)
+        """
+        popularity = popularity or {}
+        phrase_to_id = dict(synonym_dict)
+        phrase_to_id.update(hpo_dict)
+        term_ids = sorted(
+            set(phrase_to_id.values()),
+            key=lambda t: (-popularity.get(t, 0), len(hpo_names.get(t, t)), hpo_names.get(t, t))
+        )
+        self.term_ids = term_ids
+        self.names = [hpo_names.get(t, t) for t in term_ids]
+        row_of = {t: row for row, t in enumerate(term_ids)}
+
+        self.phrases = list(phrase_to_id)
+        phrase_starts, word_starts = [], []
+        for phrase_id, phrase in enumerate(self.phrases):
+            row = row_of[phrase_to_id[phrase]]
+            phrase_starts.append((phrase, row, phrase_id))
+            for m in _WORD_START.finditer(phrase):
+                if m.start() > 0:
+                    word_starts.append((phrase[m.start():], row, phrase_id))
+        self._tiers = [self._sorted_keys(phrase_starts), self._sorted_keys(word_starts)]
+
+        self._precomputed = {}
+        prefixes = {chr(c) for c in range(ord("a"), ord("z") + 1)} | set("0123456789")
+        while prefixes:
+            large = {p for p in prefixes if self._range_size(p) >= LARGE_RANGE}
+            for prefix in large:
+                self._precomputed[prefix] = self._search(prefix, MAX_LIMIT)
+            prefixes = {p + c for p in large for c in "abcdefghijklmnopqrstuvwxyz0123456789 -"}
+
+    def __len__(self):
+        return len(self.term_ids)
+
+    @staticmethod
+    def _sorted_keys(entries):
+        entries.sort()
+        return (
+            [key for key, _, _ in entries],
+            np.array([row for _, row, _ in entries], dtype=np.int32),
+            np.array([phrase_id for _, _, phrase_id in entries], dtype=np.int32),
+        )
+
+    @staticmethod
+    def _key_range(keys, prefix):
+        lo = bisect_left(keys, prefix)
+        return lo, bisect_left(keys, prefix + "\uffff", lo)
+
+    def _range_size(self, prefix):
+        return sum(hi - lo for lo, hi in (self._key_range(keys, prefix) for keys, _, _ in self._tiers))
+
+    def _search(self, prefix, limit):
+        """Best `limit` (row, phrase_id) hits: phrase-start matches first, then later-word matches."""
+        hits, seen = [], set()
+        for keys, rows, phrase_ids in self._tiers:
+            lo, hi = self._key_range(keys, prefix)
+            if lo == hi:
+                continue
+            distinct, first = np.unique(rows[lo:hi], return_index=True)
+            for row, i in zip(distinct.tolist(), first.tolist()):
+                if len(hits) >= limit:
+                    return hits
+                if row not in seen:
+                    seen.add(row)
+                    hits.append((row, int(phrase_ids[lo + i])))
+        return hits
+
+    def suggest(self, query, limit=DEFAULT_LIMIT):
+        """
+        Returns up to `limit` dicts {"id", "name", "matched"} for terms with a
+        name or synonym containing a word that starts with `query`, best first.
+        "matched" is the synonym that matched, or None when it was the name.
+        """
+        prefix = normalize(query)
+        limit = max(1, min(limit, MAX_LIMIT))
+        if not prefix:
+            return []
+        hits = self._precomputed.get(prefix)
+        if hits is None:
+            hits = self._search(prefix, limit)
+        in_name = re.compile(r"(?<![a-z0-9])" + re.escape(prefix))
+        suggestions = []
+        for row, phrase_id in hits[:limit]:
+            name = self.names[row]
+            suggestions.append({
+                "id": self.term_ids[row],
+                "name": name,
+                "matched": None if in_name.search(name.lower()) else self.phrases[phrase_id],
+            })
+        return suggestions
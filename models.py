@@ -1,6 +1,7 @@
 # models.py
 import datetime
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import inspect, text
 
 db = SQLAlchemy()
 
@@ -22,5 +23,23 @@ class Diagnosis(db.Model):
     input_text = db.Column(db.Text, nullable=False)
     hpo_terms = db.Column(db.Text, nullable=True)       # store as comma-separated or JSON
     results = db.Column(db.Text, nullable=True)         # store top disease results as JSON or text
+    explanations = db.Column(db.Text, nullable=True)    # JSON: disease -> [[hpo_id, contribution], ...]
     is_rare = db.Column(db.Boolean, default=False)
     created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+
+
+def add_missing_columns():
+    """
+    db.create_all() never alters existing tables, so nullable columns added to
+    the models later are added here with ALTER TABLE. Call inside an app context.
+    """
+    inspector = inspect(db.engine)
+    with db.engine.begin() as conn:
+        for table in db.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {c["name"] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing and column.nullable:
+                    column_type = column.type.compile(dialect=db.engine.dialect)
+                    conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"))
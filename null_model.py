@@ -0,0 +1,184 @@
+# null_model.py
+"""
+Empirical significance for Phrank scores.
+
+Raw scores are not comparable across diseases: a disease with a deep, rich
+annotation collects higher scores from any query than a sparsely annotated
+one. The offline build draws random phenotype sets of several sizes from the
+annotation background (terms weighted by how often diseases are annotated
+with them), passes them through the server's TermFilter, scores every set
+against every disease as one product with the pipeline's compiled
+contributions (so frequency weights and term weights count exactly as at
+query time), and stores a compact set of null quantiles plus mean/std per
+disease and set size. At query time a score is turned into an empirical
+p-value (by interpolating the quantiles) or a z-score with a couple of array lookups.
+
+The file records the scoring mode it was built for (see scoring_mode()); the
+server refuses a file built with different scoring or filter settings, since
+its p-values would be meaningless.
+
+Build:   python null_model.py --samples 2000
+Lookup:  NullModel.load(path).pvalue(disease_key, n_terms, score)
+"""
+import os
+import json
+import time
+import argparse
+from collections import Counter
+import numpy as np
+
+DEFAULT_NULL_MODEL_PATH = os.path.join("data", "null_model.npz")
+DEFAULT_SET_SIZES = (1, 2, 3, 4, 5, 6, 8, 10, 13, 16, 20, 25, 30)
+DEFAULT_SAMPLES = 2000
+DEFAULT_BATCH_SIZE = 250
+
+# Quantile levels kept per disease, denser in the upper tail where p-values matter
+QUANTILE_LEVELS = np.array(
+    [0.0, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.85, 0.9, 0.925, 0.95,
+     0.96, 0.97, 0.98, 0.99, 0.995, 0.998, 0.999, 1.0],
+    dtype=np.float32,
+)
+
+
+def annotation_background(pipeline):
+    """Returns (terms, probabilities): annotated HPO terms weighted by how many diseases use them."""
+    counts = Counter(t for hpo_list in pipeline.disease_to_phenotypes.values() for t in set(hpo_list))
+    terms = sorted(counts)
+    weights = np.array([counts[t] for t in terms], dtype=np.float64)
+    return terms, weights / weights.sum()
+
+
+def scoring_mode(pipeline, term_filter=None):
+    """Everything besides the knowledge base that changes the scores a null model is built from."""
+    return {
+        "pipeline": pipeline.scoring_mode(),
+        "term_filter": term_filter.settings() if term_filter is not None else None,
+    }
+
+
+def build_null_model(pipeline, set_sizes=DEFAULT_SET_SIZES, samples=DEFAULT_SAMPLES,
+                     batch_size=DEFAULT_BATCH_SIZE, seed=0, term_filter=None):
+    """
+    Samples random phenotype sets and summarises their scores per disease and set size.
+    Set sizes count the terms before `term_filter` (as queries count extracted terms).
+    """
+    rng = np.random.default_rng(seed)
+    keys = pipeline.disease_keys
+    terms = pipeline.scoring_terms()
+    column = {t: i for i, t in enumerate(terms)}
+    disease_matrix_t = np.ascontiguousarray(pipeline.weight_matrix(terms).T)
+    background, probabilities = annotation_background(pipeline)
+    set_sizes = [s for s in set_sizes if s <= len(background)]
+
+    n_levels = len(QUANTILE_LEVELS)
+    quantiles = np.empty((len(set_sizes), len(keys), n_levels), dtype=np.float32)
+    means = np.empty((len(set_sizes), len(keys)), dtype=np.float32)
+    stds = np.empty((len(set_sizes), len(keys)), dtype=np.float32)
+
+    for size_index, size in enumerate(set_sizes):
+        null_scores = np.empty((samples, len(keys)), dtype=np.float32)
+        for start in range(0, samples, batch_size):
+            n = min(batch_size, samples - start)
+            # Closure multipliers of each random set, then all diseases in one product
+            profiles = np.zeros((n, len(terms)), dtype=np.float32)
+            for row in range(n):
+                picked = rng.choice(len(background), size=size, replace=False, p=probabilities)
+                picked = [background[i] for i in picked]
+                term_weights = None
+                if term_filter is not None:
+                    picked, term_weights = term_filter.apply(picked)
+                for term, multiplier in pipeline.weighted_closure(picked, term_weights).items():
+                    col = column.get(term)
+                    if col is not None:
+                        profiles[row, col] = multiplier
+            null_scores[start:start + n] = profiles @ disease_matrix_t
+
+        quantiles[size_index] = np.quantile(null_scores, QUANTILE_LEVELS, axis=0).T
+        means[size_index] = null_scores.mean(axis=0)
+        stds[size_index] = null_scores.std(axis=0)
+
+    return NullModel(keys, np.array(set_sizes, dtype=np.int32), quantiles, means, stds, samples,
+                     scoring_mode(pipeline, term_filter))
+
+
+class NullModel:
+    """Per-disease null score quantiles for a set of query sizes."""
+
+    def __init__(self, keys, set_sizes, quantiles, means, stds, samples, scoring_mode=None):
+        self.keys = list(keys)
+        self.set_sizes = set_sizes
+        self.quantiles = quantiles
+        self.means = means
+        self.stds = stds
+        self.samples = int(samples)
+        self.scoring_mode = scoring_mode  # None for files written before it was recorded
+        self._row = {key: i for i, key in enumerate(self.keys)}
+
+    def matches_scoring_mode(self, pipeline, term_filter=None):
+        # Compared after a JSON round trip, as loaded from disk
+        return self.scoring_mode == json.loads(json.dumps(scoring_mode(pipeline, term_filter)))
+
+    def _size_index(self, n_terms):
+        """Index of the sampled set size closest to n_terms."""
+        return int(np.abs(self.set_sizes - n_terms).argmin())
+
+    def pvalue(self, disease_key, n_terms, score):
+        """
+        Empirical probability that a random set of n_terms phenotypes scores at
+        least `score` against disease_key. None for diseases not in the model.
+        """
+        row = self._row.get(disease_key)
+        if row is None:
+            return None
+        q = self.quantiles[self._size_index(n_terms), row]
+        p = 1.0 - float(np.interp(score, q, QUANTILE_LEVELS, left=0.0, right=1.0))
+        # Never claim more precision than the number of samples allows
+        return max(p, 1.0 / (self.samples + 1))
+
+    def zscore(self, disease_key, n_terms, score):
+        row = self._row.get(disease_key)
+        if row is None:
+            return None
+        size_index = self._size_index(n_terms)
+        std = float(self.stds[size_index, row])
+        return (score - float(self.means[size_index, row])) / std if std > 0 else 0.0
+
+    def annotate(self, results, n_terms):
+        """Turns [(disease_key, score), ...] into [(disease_key, score, p-value, z-score), ...]."""
+        return [
+            (key, score, self.pvalue(key, n_terms, score), self.zscore(key, n_terms, score))
+            for key, score in results
+        ]
+
+    def save(self, path):
+        np.savez_compressed(path, keys=np.array(self.keys), set_sizes=self.set_sizes,
+                            quantiles=self.quantiles, means=self.means, stds=self.stds,
+                            samples=np.array(self.samples),
+                            scoring_mode=np.array(json.dumps(self.scoring_mode)))
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as data:
+            scoring_mode = json.loads(data["scoring_mode"].item()) if "scoring_mode" in data.files else None
+            return cls(data["keys"].tolist(), data["set_sizes"], data["quantiles"],
+                       data["means"], data["stds"], data["samples"], scoring_mode)
+
+
+if __name__ == "__main__":
+    from app import get_pipeline, get_term_filter
+
+    parser = argparse.ArgumentParser(description="Precompute per-disease null score distributions.")
+    parser.add_argument("--out", default=DEFAULT_NULL_MODEL_PATH)
+    parser.add_argument("--samples", type=int, default=DEFAULT_SAMPLES, help="Random sets per set size")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SET_SIZES))
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    # The server's pipeline and term filter, so the nulls match the scores they calibrate
+    pipeline, term_filter = get_pipeline(), get_term_filter()
+
+    started = time.time()
+    model = build_null_model(pipeline, args.sizes, args.samples, seed=args.seed, term_filter=term_filter)
+    model.save(args.out)
+    print(f"Wrote null distributions for {len(model.keys)} diseases x {len(model.set_sizes)} set sizes "
+          f"to {args.out} in {time.time() - started:.1f}s.")
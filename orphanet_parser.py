@@ -2,7 +2,6 @@
 
 import os
 import json
-from lxml import etree # type: ignore
 
 def parse_orphanet(xml_path):
     """
@@ -22,7 +21,8 @@ def parse_orphanet(xml_path):
       ...
     }
     """
-    # 1. Parse the XML
+    # 1. Parse the XML (lxml is only imported when the XML actually has to be parsed)
+    from lxml import etree  # type: ignore
     tree = etree.parse(xml_path)
     root = tree.getroot()
     
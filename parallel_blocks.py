@@ -0,0 +1,42 @@
+# parallel_blocks.py
+"""
+Process pool scaffolding for the offline all-pairs builds.
+
+The rows to score are split into blocks; each block is scored by
+`score_block(start, state)`, a module-level function returning
+(start, neighbour indices, scores) for rows [start, start + len(indices)).
+`state` (the matrices and settings every block needs) is handed to each
+worker process once by the pool initializer rather than with every block.
+"""
+from concurrent.futures import ProcessPoolExecutor
+
+# Set once per worker process by the pool initializer
+_worker_state = {}
+
+
+def _init_worker(score_block, state):
+    _worker_state.update(state, score_block=score_block)
+
+
+def _run_block(start):
+    return _worker_state["score_block"](start, _worker_state)
+
+
+def fill_blocks(score_block, state, starts, neighbors, scores, workers=None):
+    """
+    Scores every block and copies its results into the `neighbors` and
+    `scores` arrays in place. workers=1 runs in this process; None uses all cores.
+    """
+    if workers == 1:
+        blocks = (score_block(start, state) for start in starts)
+        _fill(neighbors, scores, blocks)
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(score_block, state)) as pool:
+            _fill(neighbors, scores, pool.map(_run_block, starts))
+
+
+def _fill(neighbors, scores, blocks):
+    for start, index, block_scores in blocks:
+        neighbors[start:start + len(index)] = index
+        scores[start:start + len(index)] = block_scores
@@ -0,0 +1,232 @@
+# patient_matching.py
+"""
+Patient-to-patient matchmaking over stored diagnoses.
+
+Every saved Diagnosis is indexed by its ancestor-closed HPO profile in an
+inverted index (HPO term -> rows of the patients whose closure contains it).
+A query walks the postings of its own closure once and adds the term's
+marginal IC to every patient on the list, which yields the same marginal-IC
+score Phrank uses for patient-vs-disease ranking without touching patients
+that share nothing with the query.
+
+    index = PatientIndex(phrank_pipeline)
+    index.load_from_db()                      # once
+    index.catch_up()                          # before each query: rows saved since
+    index.most_similar(["HP:0001250"], k=10)  # -> [(diagnosis_id, score), ...]
+    index.most_similar(terms, owner_id=user_id)  # only that user's own diagnoses
+
+Each server process holds its own index, so catch_up() reads the diagnoses
+saved since the last one it indexed (Diagnosis.id above a watermark). That picks up
+rows saved by other worker processes as well as this one's.
+
+The all-pairs mode (for cohort clustering) scores blocks of patients against
+the whole cohort at a time, spreads the blocks across processes and keeps only
+the top-k neighbours per patient:
+
+    python patient_matching.py --top-k 20 --workers 8 --out data/cohort_neighbours.npz
+"""
+import os
+import json
+import time
+import argparse
+import threading
+from array import array
+import numpy as np
+from parallel_blocks import fill_blocks
+
+DEFAULT_TOP_K = 10
+DEFAULT_BLOCK_SIZE = 32
+
+
+class PatientIndex:
+    def __init__(self, pipeline):
+        self.pipeline = pipeline
+        self.diagnosis_ids = array("q")   # row -> Diagnosis.id
+        self.owner_ids = array("q")       # row -> Diagnosis.user_id
+        self._profiles = []               # row -> tuple of informative closure terms
+        self._postings = {}               # HPO ID -> array of rows
+        self._rows = {}                   # Diagnosis.id -> row
+        self.last_indexed_id = 0          # highest Diagnosis.id read from the database
+        self._lock = threading.RLock()
+        self._catch_up_lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.diagnosis_ids)
+
+    def _profile(self, hpo_terms):
+        ic = self.pipeline.marginal_ic
+        return tuple(t for t in self.pipeline.term_closure(hpo_terms) if ic.get(t, 0) > 0)
+
+    def add(self, diagnosis_id, hpo_terms, owner_id=0):
+        """Indexes one diagnosis of user owner_id. Re-adding a known diagnosis_id is a no-op."""
+        profile = self._profile(hpo_terms)
+        with self._lock:
+            if diagnosis_id in self._rows:
+                return
+            row = len(self.diagnosis_ids)
+            self.diagnosis_ids.append(diagnosis_id)
+            self.owner_ids.append(owner_id)
+            self._rows[diagnosis_id] = row
+            self._profiles.append(profile)
+            for term in profile:
+                postings = self._postings.get(term)
+                if postings is None:
+                    postings = self._postings[term] = array("i")
+                postings.append(row)
+
+    def catch_up(self, batch_size=1000):
+        """
+        Indexes the diagnoses stored since the last call (Diagnosis.id above
+        last_indexed_id), streaming rows in batches. Returns how many were read.
+        Needs an app context.
+        """
+        from models import Diagnosis
+        with self._catch_up_lock:
+            query = (
+                Diagnosis.query.with_entities(Diagnosis.id, Diagnosis.user_id, Diagnosis.hpo_terms)
+                .filter(Diagnosis.id > self.last_indexed_id)
+                .order_by(Diagnosis.id)
+            )
+            count = 0
+            for diagnosis_id, user_id, hpo_terms in query.yield_per(batch_size):
+                if hpo_terms:
+                    self.add(diagnosis_id, json.loads(hpo_terms), user_id)
+                self.last_indexed_id = diagnosis_id
+                count += 1
+            return count
+
+    def load_from_db(self, batch_size=1000):
+        """Indexes every stored Diagnosis. Needs an app context."""
+        self.catch_up(batch_size)
+        return self
+
+    def _scores(self, profile, n_rows):
+        ic = self.pipeline.marginal_ic
+        scores = np.zeros(n_rows, dtype=np.float32)
+        for term in profile:
+            postings = self._postings.get(term)
+            if postings:
+                scores[np.frombuffer(postings, dtype=np.int32)] += ic[term]
+        return scores
+
+    def most_similar(self, hpo_terms, k=DEFAULT_TOP_K, exclude=(), owner_id=None):
+        """
+        Returns up to k (diagnosis_id, score) pairs for the stored patients most
+        similar to hpo_terms, best first. Diagnosis IDs in `exclude` are skipped;
+        with owner_id, only that user's diagnoses are considered.
+        """
+        profile = self._profile(hpo_terms)
+        with self._lock:
+            n_rows = len(self.diagnosis_ids)
+            if not n_rows or not profile:
+                return []
+            scores = self._scores(profile, n_rows)
+            if owner_id is not None:
+                scores[np.frombuffer(self.owner_ids, dtype=np.int64)[:n_rows] != owner_id] = 0
+            for diagnosis_id in exclude:
+                row = self._rows.get(diagnosis_id)
+                if row is not None:
+                    scores[row] = 0
+
+            k = min(k, n_rows)
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top], kind="stable")]
+            return [(self.diagnosis_ids[r], float(scores[r])) for r in top if scores[r] > 0]
+
+    def frozen_postings(self):
+        """Copies the postings into numpy arrays for the all-pairs mode."""
+        with self._lock:
+            return {term: np.array(rows, dtype=np.int32) for term, rows in self._postings.items()}
+
+    def all_pairs_top_k(self, k=DEFAULT_TOP_K, block_size=DEFAULT_BLOCK_SIZE, workers=None):
+        """
+        Top-k most similar other patients for every indexed patient.
+        Returns (diagnosis_ids, neighbour rows, scores); missing neighbours are -1 / 0.
+        """
+        with self._lock:
+            profiles = list(self._profiles)
+            ids = np.array(self.diagnosis_ids, dtype=np.int64)
+        postings = self.frozen_postings()
+        weights = {term: self.pipeline.marginal_ic[term] for term in postings}
+
+        n = len(profiles)
+        k = min(k, max(n - 1, 1))
+        neighbors = np.full((n, k), -1, dtype=np.int32)
+        scores = np.zeros((n, k), dtype=np.float32)
+        state = {"profiles": profiles, "postings": postings, "weights": weights, "k": k, "block_size": block_size}
+        fill_blocks(_score_patient_block, state, range(0, n, block_size), neighbors, scores, workers)
+        return ids, neighbors, scores
+
+
+def _score_patient_block(start, s):
+    """Scores patients [start, start + block_size) against the whole cohort (s: the pool state)."""
+    profiles, postings, weights = s["profiles"], s["postings"], s["weights"]
+    block = profiles[start:start + s["block_size"]]
+    n = len(profiles)
+
+    # Group the block's patients by term so each posting list is read once per block
+    members = {}
+    for i, profile in enumerate(block):
+        for term in profile:
+            members.setdefault(term, []).append(i)
+
+    scores = np.zeros((len(block), n), dtype=np.float32)
+    for term, local_rows in members.items():
+        scores[np.ix_(local_rows, postings[term])] += weights[term]
+    scores[np.arange(len(block)), np.arange(start, start + len(block))] = 0  # never match yourself
+
+    k = s["k"]
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    top_scores = np.take_along_axis(scores, top, axis=1)
+    order = np.argsort(-top_scores, axis=1, kind="stable")
+    top = np.take_along_axis(top, order, axis=1).astype(np.int32)
+    top_scores = np.take_along_axis(top_scores, order, axis=1)
+    top[top_scores <= 0] = -1
+    return start, top, top_scores
+
+
+def cluster_neighbors(neighbors, scores, min_score):
+    """
+    Groups patients into clusters: connected components of the top-k neighbour
+    graph restricted to edges scoring at least min_score. Returns a cluster label per row.
+    """
+    parent = np.arange(neighbors.shape[0])
+
+    def find(x):
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    rows, cols = np.nonzero((scores >= min_score) & (neighbors >= 0))
+    for row, col in zip(rows, cols):
+        a, b = find(row), find(neighbors[row, col])
+        if a != b:
+            parent[max(a, b)] = min(a, b)
+    return np.array([find(x) for x in range(len(parent))])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="All-pairs patient similarity over stored diagnoses.")
+    parser.add_argument("--out", default=os.path.join("data", "cohort_neighbours.npz"))
+    parser.add_argument("--top-k", type=int, default=DEFAULT_TOP_K)
+    parser.add_argument("--block-size", type=int, default=DEFAULT_BLOCK_SIZE)
+    parser.add_argument("--workers", type=int, default=None, help="Processes (default: all cores)")
+    parser.add_argument("--min-score", type=float, default=None,
+                        help="Also cluster patients whose neighbour score is at least this value")
+    args = parser.parse_args()
+
+    # The server's pipeline, so neighbour scores match the ones it serves
+    from app import app, get_pipeline
+
+    with app.app_context():
+        index = PatientIndex(get_pipeline()).load_from_db()
+
+    started = time.time()
+    ids, neighbors, scores = index.all_pairs_top_k(args.top_k, args.block_size, args.workers)
+    result = {"diagnosis_ids": ids, "neighbors": neighbors, "scores": scores}
+    if args.min_score is not None:
+        result["clusters"] = cluster_neighbors(neighbors, scores, args.min_score)
+    np.savez_compressed(args.out, **result)
+    print(f"Wrote top-{args.top_k} neighbours for {len(ids)} patients to {args.out} "
+          f"in {time.time() - started:.1f}s.")
@@ -4,7 +4,10 @@ def load_maps(human_phenotype_map_file):
     child_to_parent = defaultdict(list)
     parent_to_children = defaultdict(list)
     for hpo_line in hpo_file:
-        hpo_tokens = hpo_line.strip().split("\t")
+        # child and parent separated by a tab or spaces (data/hp_dag.txt uses a space)
+        hpo_tokens = hpo_line.split()
+        if len(hpo_tokens) < 2:
+            continue
         child = hpo_tokens[0]
         parent = hpo_tokens[1]
         child_to_parent[child].append(parent)
@@ -1,31 +1,313 @@
 # phrank_pipeline.py
 import os
+from collections import defaultdict
+import numpy as np
 from phrank import Phrank
+from phrank.utils import closure, load_disease_gene
+
+DEFAULT_DAG_PATH = os.path.join("data", "hp_dag.txt")
+
+# Orphanet frequency classes -> approximate probability of the phenotype in the disease
+FREQUENCY_WEIGHTS = {
+    "Obligate": 1.0,        # 100%
+    "Very frequent": 0.9,   # 99-80%
+    "Frequent": 0.55,       # 79-30%
+    "Occasional": 0.17,     # 29-5%
+    "Very rare": 0.025,     # <4-1%
+}
+EXCLUDED_FREQUENCY = "Excluded"  # 0%: the phenotype argues against the disease
+
+
+def frequency_weight(label):
+    """Weight for an Orphanet frequency label such as "Very frequent (99-80%)"; 1.0 if unknown."""
+    if not label:
+        return 1.0
+    return FREQUENCY_WEIGHTS.get(label.split(" (")[0].strip(), 1.0)
+
 
 class PhrankPipeline:
-    def __init__(self, hpo_file, disease_data):
+    def __init__(self, dag_file, disease_data, disease_gene_file=None,
+                 use_frequencies=False, excluded_penalty=1.0):
         """
+        dag_file: HPO DAG as "child parent" lines (see phrank.utils.load_maps), e.g. data/hp_dag.txt
         disease_data: dict of disease_key -> { 'hpo_terms': [...], 'frequencies': {...} }
+        disease_gene_file: optional "gene<TAB>disease" file (see phrank.utils.load_disease_gene);
+            diseases may be given as the full disease_key or just its "ORPHA:XXXX" part
+        use_frequencies: weight each disease phenotype by its Orphanet frequency and
+            penalise patient phenotypes the disease is annotated as excluding
+        excluded_penalty: multiple of an excluded term's IC subtracted when the patient has it
         """
-        self.phrank = Phrank(hpo_file=hpo_file)
-        
+        self.phrank = Phrank(dag_file)
+        self.use_frequencies = use_frequencies
+        self.excluded_penalty = excluded_penalty
+
         # Convert disease_data into the format Phrank needs
         self.disease_to_phenotypes = {
             disease_key: info["hpo_terms"] for disease_key, info in disease_data.items()
         }
-        self.phrank.load_knowledge_base(self.disease_to_phenotypes)
+        # Information content over the diseases (each disease counts once, like a gene in Phrank)
+        self.phrank._IC, self.phrank._marginal_IC = Phrank.compute_information_content(
+            self.disease_to_phenotypes, self.phrank._child_to_parent
+        )
+
+        # Ancestor-closed phenotype set of every disease, computed once
+        self._ancestor_cache = {}
+        self.disease_closures = {
+            disease_key: frozenset(self.term_closure(hpo_list))
+            for disease_key, hpo_list in self.disease_to_phenotypes.items()
+        }
+
+        # disease_key -> set of gene IDs, used to restrict ranking to a patient's candidate genes
+        self.disease_to_genes = {}
+        if disease_gene_file:
+            gene_map = load_disease_gene(disease_gene_file)
+            for disease_key in self.disease_to_phenotypes:
+                genes = gene_map.get(disease_key) or gene_map.get(disease_key.split(" | ")[0])
+                if genes:
+                    self.disease_to_genes[disease_key] = genes
+
+        self._compile_scoring_profiles(disease_data)
+
+    @property
+    def information_content(self):
+        """HPO ID -> information content of the term itself (used for filtering, not scoring)."""
+        return self.phrank._IC
+
+    @property
+    def marginal_ic(self):
+        """HPO ID -> marginal information content used by the Phrank score."""
+        return self.phrank._marginal_IC
+
+    def term_closure(self, hpo_terms):
+        """
+        Returns the set of the given HPO terms plus all their ancestors.
+        Ancestors are memoised per term, so repeated closures are cheap.
+        """
+        result = set()
+        for term in hpo_terms:
+            ancestors = self._ancestor_cache.get(term)
+            if ancestors is None:
+                ancestors = frozenset(closure([term], self.phrank._child_to_parent))
+                self._ancestor_cache[term] = ancestors
+            result |= ancestors
+        return result
+
+    def disease_term_weights(self, disease_key, frequencies=None):
+        """
+        HPO term -> score contribution when the patient's closure contains the term.
+        Unweighted this is the marginal IC of every term in the disease closure (the
+        Phrank score). With frequencies, each closure term is scaled by the highest
+        frequency weight of the annotations below it, and excluded annotations that
+        are not implied by any present one contribute a negative penalty.
+        """
+        ic = self.marginal_ic
+        if not self.use_frequencies:
+            return {t: ic[t] for t in self.disease_closures[disease_key] if ic.get(t, 0)}
+
+        frequencies = frequencies or {}
+        present, excluded = {}, []
+        for term in self.disease_to_phenotypes[disease_key]:
+            label = frequencies.get(term)
+            if label and label.startswith(EXCLUDED_FREQUENCY):
+                excluded.append(term)
+                continue
+            weight = frequency_weight(label)
+            for ancestor in self.term_closure([term]):
+                if weight > present.get(ancestor, 0):
+                    present[ancestor] = weight
+
+        weights = {t: ic[t] * w for t, w in present.items() if ic.get(t, 0)}
+        for term in excluded:
+            if term not in present and ic.get(term, 0):
+                weights[term] = -self.excluded_penalty * ic[term]
+        return weights
+
+    def _compile_scoring_profiles(self, disease_data):
+        """
+        Folds every disease's term weights into one inverted index,
+        HPO term -> (disease rows, contributions), so ranking is a single pass
+        over the patient closure with no per-query lookups into disease data.
+        """
+        self.disease_keys = list(self.disease_to_phenotypes)
+        self._row = {disease_key: row for row, disease_key in enumerate(self.disease_keys)}
+        rows_by_term, weights_by_term = defaultdict(list), defaultdict(list)
+        for row, disease_key in enumerate(self.disease_keys):
+            frequencies = disease_data[disease_key].get("frequencies")
+            for term, weight in self.disease_term_weights(disease_key, frequencies).items():
+                rows_by_term[term].append(row)
+                weights_by_term[term].append(weight)
+
+        self._postings = {
+            term: (np.array(rows, dtype=np.int32), np.array(weights_by_term[term], dtype=np.float32))
+            for term, rows in rows_by_term.items()
+        }
+
+    def scoring_mode(self):
+        """Settings that change scores; stored with precomputed score tables so stale ones are refused."""
+        return {"use_frequencies": bool(self.use_frequencies), "excluded_penalty": float(self.excluded_penalty)}
+
+    def scoring_terms(self):
+        """Sorted HPO terms that contribute to at least one disease's score."""
+        return sorted(self._postings)
 
-    def rank_diseases(self, patient_hpo_list, threshold=0.2):
+    def weight_matrix(self, terms):
+        """
+        Dense disease x term matrix (float32, rows in self.disease_keys order) of
+        the compiled contributions, so scoring patient profiles P is P @ matrix.T.
+        """
+        column = {term: col for col, term in enumerate(terms)}
+        matrix = np.zeros((len(self.disease_keys), len(terms)), dtype=np.float32)
+        for term, (rows, weights) in self._postings.items():
+            col = column.get(term)
+            if col is not None:
+                matrix[rows, col] = weights
+        return matrix
+
+    def weighted_closure(self, patient_hpo_list, term_weights=None):
+        """
+        Closure term -> multiplier for its contribution. A closure term takes the
+        highest weight among the patient terms implying it; unlisted terms weigh 1.0.
+        """
+        if not term_weights:
+            return dict.fromkeys(self.term_closure(patient_hpo_list), 1.0)
+        result = {}
+        for term in patient_hpo_list:
+            weight = term_weights.get(term, 1.0)
+            for ancestor in self.term_closure([term]):
+                if weight > result.get(ancestor, 0):
+                    result[ancestor] = weight
+        return result
+
+    def closure_sources(self, patient_hpo_list, multipliers, term_weights=None):
+        """
+        Closure term -> the patient terms it is credited to: those implying it
+        with the weight it is scored at (every implying term when unweighted).
+        """
+        sources = defaultdict(list)
+        for term in dict.fromkeys(patient_hpo_list):
+            weight = term_weights.get(term, 1.0) if term_weights else 1.0
+            for ancestor in self.term_closure([term]):
+                if weight == multipliers.get(ancestor):
+                    sources[ancestor].append(term)
+        return sources
+
+    def _add_postings(self, scores, terms, multipliers, trace, sources=None):
+        """Adds the postings of `terms`, scaled by their multipliers, to `scores` in place."""
+        for term in terms:
+            multiplier = multipliers[term]
+            posting = self._postings.get(term)
+            if posting is not None:
+                rows, weights = posting
+                if multiplier != 1.0:
+                    weights = weights * multiplier
+                scores[rows] += weights
+                if trace is not None:
+                    trace.append((term, rows, weights, sources[term]))
+
+    def score_all(self, patient_hpo_list, trace=None, term_weights=None):
+        """
+        Scores of every disease (in self.disease_keys order) for one patient.
+        If a `trace` list is given, the (term, rows, weights, patient terms)
+        postings added up are appended to it so contributions can be explained
+        afterwards in terms of the patient's own phenotypes.
+        term_weights: optional patient term -> weight (e.g. from TermFilter)
+        """
+        scores = np.zeros(len(self.disease_keys), dtype=np.float64)
+        multipliers = self.weighted_closure(patient_hpo_list, term_weights)
+        sources = self.closure_sources(patient_hpo_list, multipliers, term_weights) if trace is not None else None
+        self._add_postings(scores, multipliers, multipliers, trace, sources)
+        return scores
+
+    def score_in_stages(self, patient_hpo_list, trace=None, term_weights=None, checkpoints=(0.5,)):
+        """
+        Generator of partial scores for progressive display. Closure terms are
+        added highest-IC first; (fraction, scores) is yielded once the added terms
+        carry each checkpoint fraction of the patient's total IC, and (1.0, scores)
+        when complete. The same array is updated in place between yields.
+        """
+        ic = self.marginal_ic
+        multipliers = self.weighted_closure(patient_hpo_list, term_weights)
+        sources = self.closure_sources(patient_hpo_list, multipliers, term_weights) if trace is not None else None
+        terms = sorted(multipliers, key=lambda t: ic.get(t, 0) * multipliers[t], reverse=True)
+        total = sum(ic.get(t, 0) * multipliers[t] for t in terms)
+        scores = np.zeros(len(self.disease_keys), dtype=np.float64)
+
+        start, covered = 0, 0.0
+        for fraction in sorted(f for f in checkpoints if 0 < f < 1):
+            end = start
+            while end < len(terms) and covered < fraction * total:
+                covered += ic.get(terms[end], 0) * multipliers[terms[end]]
+                end += 1
+            self._add_postings(scores, terms[start:end], multipliers, trace, sources)
+            start = end
+            yield fraction, scores
+        self._add_postings(scores, terms[start:], multipliers, trace, sources)
+        yield 1.0, scores
+
+    def rank_diseases(self, patient_hpo_list, threshold=0.2, patient_genes=None, term_weights=None):
         """
         Returns a sorted list of (disease_key, score) and a boolean: is_below_threshold
+        If patient_genes is non-empty, only diseases linked to one of those genes are ranked.
+        """
+        return self._rank(self.score_all(patient_hpo_list, term_weights=term_weights), threshold, patient_genes)
+
+    def rank_diseases_with_explanations(self, patient_hpo_list, threshold=0.2, patient_genes=None,
+                                        top_k=10, max_terms=10, term_weights=None):
+        """
+        Like rank_diseases, plus a dict disease_key -> [(patient hpo_id, contribution), ...]
+        for the top_k diseases, largest contributions first (at most max_terms each).
+        Contributions come from the postings recorded while scoring, not a re-score.
+        """
+        trace = []
+        scores = self.score_all(patient_hpo_list, trace, term_weights)
+        results, is_rare = self._rank(scores, threshold, patient_genes)
+        return results, is_rare, self._explain(trace, results[:top_k], max_terms)
+
+    def rank_progressively(self, patient_hpo_list, threshold=0.2, patient_genes=None,
+                           top_k=10, max_terms=10, term_weights=None, checkpoints=(0.5,)):
+        """
+        Generator for streaming results: yields ("provisional", top_k results) at
+        each checkpoint of score_in_stages, then ("final", (results, is_rare,
+        explanations)) as rank_diseases_with_explanations would return them.
+        """
+        trace = []
+        for fraction, scores in self.score_in_stages(patient_hpo_list, trace, term_weights, checkpoints):
+            if fraction < 1.0:
+                yield "provisional", self._rank(scores, threshold, patient_genes)[0][:top_k]
+        results, is_rare = self._rank(scores, threshold, patient_genes)
+        yield "final", (results, is_rare, self._explain(trace, results[:top_k], max_terms))
+
+    def _explain(self, trace, top_results, max_terms):
+        """
+        disease_key -> its largest (patient hpo_id, contribution) pairs. Each traced
+        closure term's contribution is split evenly between the patient terms it
+        is credited to, so a disease's contributions add up to its score.
         """
-        results = []
-        for disease_key, hpo_list in self.disease_to_phenotypes.items():
-            score = self.phrank.score_phenotype_sets(patient_hpo_list, hpo_list)
-            results.append((disease_key, score))
+        explanations = {}
+        for disease_key, _ in top_results:
+            row = self._row[disease_key]
+            credit = defaultdict(float)
+            for term, rows, weights, patient_terms in trace:
+                # rows are ascending (diseases were compiled in order)
+                i = np.searchsorted(rows, row)
+                if i < len(rows) and rows[i] == row and patient_terms:
+                    share = float(weights[i]) / len(patient_terms)
+                    for patient_term in patient_terms:
+                        credit[patient_term] += share
+            contributions = sorted(credit.items(), key=lambda x: abs(x[1]), reverse=True)
+            explanations[disease_key] = contributions[:max_terms]
+        return explanations
 
-        # Sort descending
-        results.sort(key=lambda x: x[1], reverse=True)
+    def _rank(self, scores, threshold, patient_genes):
+        """Sorts the score vector into (disease_key, score) results plus the rare/novel flag."""
+        # Sort descending (stable, so ties keep the knowledge-base order)
+        order = np.argsort(-scores, kind="stable")
+        results = [(self.disease_keys[row], float(scores[row])) for row in order]
+        if patient_genes:
+            results = [
+                (disease_key, score) for disease_key, score in results
+                if self.disease_to_genes.get(disease_key, set()) & patient_genes
+            ]
 
         if not results:
             # If no diseases at all, treat as rare
@@ -1,43 +1,334 @@
 # real_clinphen.py
-import subprocess
-import tempfile
+"""
+ClinPhen extraction through a pool of long-lived worker processes.
+
+Each worker is started once and then answers requests over its stdin/stdout
+pipes, so the interpreter and the ClinPhen dictionaries are loaded once per
+worker instead of once per note. The protocol is one JSON object per line:
+
+    worker -> pool   {"ready": true}                           (once, at startup)
+    pool -> worker   {"id": 7, "notes": ["text 1", "text 2"]}
+    worker -> pool   {"id": 7, "terms": [["HP:0001250"], []]}
+                     {"id": 7, "error": "message"}             (on failure)
+
+Any executable speaking this protocol can be used as a worker, which makes it
+easy to test the pool with a small stub script (tests/stub_clinphen_worker.py).
+When ClinPhen is not installed (or no worker can be started) the built-in
+dictionary extractor is used instead.
+
+Worst-case latency: a batch that crashes or hangs its worker is retried once
+on a fresh worker before falling back, and a worker that fails is killed
+straight away. A note that hangs every worker therefore holds its request for
+up to 2 * timeout plus the replacement worker's start-up (at most
+startup_timeout): about 60 s plus start-up with the defaults. Lower `timeout`
+where that matters more than giving ClinPhen time on long notes.
+"""
+import os
+import sys
+import json
+import queue
+import atexit
 import logging
+import itertools
+import threading
+import subprocess
+import importlib.util
 
 logger = logging.getLogger(__name__)
 
+DEFAULT_POOL_SIZE = 2
+DEFAULT_BATCH_SIZE = 16
+DEFAULT_TIMEOUT = 30.0          # seconds allowed for one round trip
+DEFAULT_STARTUP_TIMEOUT = 60.0  # seconds allowed for a worker to report ready
+
+
+class WorkerError(Exception):
+    """Raised when a worker crashes, times out or breaks the protocol."""
+
+
+def default_worker_command():
+    """
+    Returns the command that starts a ClinPhen worker (this module in --worker
+    mode), or None if the ClinPhen package is not installed.
+    """
+    if importlib.util.find_spec("clinphen_src") is None:
+        return None
+    return [sys.executable, os.path.abspath(__file__), "--worker"]
+
+
+def parse_clinphen_output(output: str) -> list:
+    """
+    Extracts the unique HPO IDs (first column) from ClinPhen's tab-separated output.
+    """
+    hpo_terms = []
+    for line in output.splitlines():
+        line = line.strip()
+        if line.startswith("HP:"):
+            hpo_id = line.split("\t")[0]
+            if hpo_id not in hpo_terms:
+                hpo_terms.append(hpo_id)
+    return hpo_terms
+
+
+def _builtin_extractor(text: str) -> list:
+    # Imported lazily so the dictionaries are only loaded when actually needed
+    from custom_hpo_extractor import run_custom_extractor
+    return run_custom_extractor(text)
+
+
+class _Worker:
+    """One worker process plus a reader thread that makes reads time out."""
+
+    def __init__(self, command, startup_timeout):
+        self.proc = subprocess.Popen(
+            command,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            text=True,
+            bufsize=1,
+        )
+        self._lines = queue.Queue()
+        self._reader = threading.Thread(target=self._pump, daemon=True)
+        self._reader.start()
+
+        try:
+            hello = self._read(startup_timeout)
+        except WorkerError:
+            self.kill()
+            raise
+        if hello.get("ready") is not True:
+            self.close()
+            raise WorkerError(f"Worker refused to start: {hello.get('error', hello)}")
+
+    def _pump(self):
+        for line in self.proc.stdout:
+            self._lines.put(line)
+        self._lines.put(None)  # EOF marker: the worker exited
+
+    def _read(self, timeout):
+        try:
+            line = self._lines.get(timeout=timeout)
+        except queue.Empty:
+            raise WorkerError(f"Worker did not answer within {timeout}s")
+        if line is None:
+            raise WorkerError("Worker exited unexpectedly")
+        try:
+            return json.loads(line)
+        except json.JSONDecodeError:
+            raise WorkerError(f"Malformed worker response: {line[:200]!r}")
+
+    def request(self, request_id, notes, timeout):
+        try:
+            self.proc.stdin.write(json.dumps({"id": request_id, "notes": notes}) + "\n")
+            self.proc.stdin.flush()
+        except (BrokenPipeError, OSError) as e:
+            raise WorkerError(f"Could not send request to worker: {e}")
+
+        response = self._read(timeout)
+        if response.get("id") != request_id:
+            raise WorkerError(f"Worker answered request {response.get('id')}, expected {request_id}")
+        if "error" in response:
+            raise WorkerError(response["error"])
+        terms = response.get("terms")
+        if not isinstance(terms, list) or len(terms) != len(notes):
+            raise WorkerError("Worker returned the wrong number of results")
+        return terms
+
+    def kill(self):
+        """Stops a worker that failed; a hung worker would not exit on its own."""
+        self.proc.kill()
+        self.proc.wait()
+        try:
+            self.proc.stdin.close()
+        except OSError:
+            pass
+
+    def close(self):
+        try:
+            self.proc.stdin.close()
+        except OSError:
+            pass
+        try:
+            self.proc.wait(timeout=2)
+        except subprocess.TimeoutExpired:
+            self.proc.kill()
+            self.proc.wait()
+
+
+class ClinPhenPool:
+    """
+    A fixed number of worker slots. A slot holds a running worker, or None when
+    its worker crashed and has not been restarted yet; dead slots are restarted
+    the next time they are handed out. See the module docstring for how long a
+    crashing or hanging note can hold a request.
+    """
+
+    def __init__(self, command=None, size=DEFAULT_POOL_SIZE, batch_size=DEFAULT_BATCH_SIZE,
+                 timeout=DEFAULT_TIMEOUT, startup_timeout=DEFAULT_STARTUP_TIMEOUT,
+                 fallback=_builtin_extractor):
+        self.command = command if command is not None else default_worker_command()
+        self.size = size
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self.startup_timeout = startup_timeout
+        self.fallback = fallback
+
+        self._slots = queue.Queue()
+        for _ in range(size):
+            self._slots.put(None)
+        self._ids = itertools.count(1)
+        self._closed = False
+
+        if self.command is None:
+            logger.info("ClinPhen is not installed; using the built-in extractor.")
+
+    @property
+    def available(self):
+        return self.command is not None and not self._closed
+
+    def _spawn(self):
+        try:
+            return _Worker(self.command, self.startup_timeout)
+        except (OSError, WorkerError) as e:
+            logger.error(f"Could not start ClinPhen worker {self.command}: {e}")
+            return None
+
+    def _round_trip(self, notes):
+        worker = self._slots.get()
+        try:
+            # Try once with the current worker and once more with a fresh one
+            for attempt in range(2):
+                if worker is None:
+                    worker = self._spawn()
+                    if worker is None:
+                        break
+                try:
+                    return worker.request(next(self._ids), notes, self.timeout)
+                except WorkerError as e:
+                    logger.warning(f"ClinPhen worker failed (attempt {attempt + 1}): {e}")
+                    worker.kill()
+                    worker = None
+        finally:
+            self._slots.put(worker)
+
+        logger.error("ClinPhen workers unavailable; falling back to the built-in extractor.")
+        return [self.fallback(note) for note in notes]
+
+    def extract_batch(self, notes):
+        """
+        Returns one list of HPO IDs per note, sending up to `batch_size` notes
+        per round trip.
+        """
+        notes = list(notes)
+        if not self.available:
+            return [self.fallback(note) for note in notes]
+
+        results = []
+        for start in range(0, len(notes), self.batch_size):
+            results.extend(self._round_trip(notes[start:start + self.batch_size]))
+        return results
+
+    def extract(self, text):
+        return self.extract_batch([text])[0]
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        for _ in range(self.size):
+            worker = self._slots.get()
+            if worker is not None:
+                worker.close()
+
+
+_default_pool = None
+_default_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Returns the process-wide pool, creating it on first use."""
+    global _default_pool
+    if _default_pool is None:
+        with _default_pool_lock:
+            if _default_pool is None:
+                _default_pool = ClinPhenPool()
+                atexit.register(_default_pool.close)
+    return _default_pool
+
+
 def run_clinphen(text: str):
     """
-    Calls the ClinPhen CLI to extract HPO terms from plain text.
+    Calls ClinPhen to extract HPO terms from plain text.
     Returns a list of HPO term IDs.
     """
-    # If text is very large, handle carefully. We'll do a naive approach here.
-    # This function can raise an exception if ClinPhen is not installed or fails.
+    try:
+        return get_pool().extract(text)
+    except Exception:
+        logger.exception("Error running ClinPhen.")
+        return []
 
-    with tempfile.NamedTemporaryFile(mode='w', delete=False) as tmp_in:
-        tmp_in_name = tmp_in.name
-        tmp_in.write(text)
 
-    tmp_out_name = tmp_in_name + "_out.txt"
+def run_clinphen_batch(notes):
+    """
+    Extracts HPO terms from several notes in as few round trips as possible.
+    Returns one list of HPO term IDs per note.
+    """
+    try:
+        return get_pool().extract_batch(notes)
+    except Exception:
+        logger.exception("Error running ClinPhen.")
+        return [[] for _ in notes]
+
+
+# -------------------------------------------------------------------
+# Worker side
+# -------------------------------------------------------------------
+def _worker_main():
+    # Keep stray prints from ClinPhen out of the protocol stream
+    out = sys.stdout
+    sys.stdout = sys.stderr
+
+    def send(message):
+        out.write(json.dumps(message) + "\n")
+        out.flush()
 
     try:
-        cmd = f"clinphen -f {tmp_in_name} -o {tmp_out_name}"
-        subprocess.run(cmd, shell=True, check=True)
+        from clinphen_src import get_phenotypes
+    except ImportError as e:
+        send({"ready": False, "error": f"ClinPhen is not installed: {e}"})
+        return 1
 
-        # Read output
-        with open(tmp_out_name, "r") as f:
-            lines = f.readlines()
+    names_file = os.path.join(os.path.dirname(get_phenotypes.__file__), "data", "hpo_term_names.txt")
+    hpo_to_name = {}
+    with open(names_file) as f:
+        for line in f:
+            parts = line.strip().split("\t")
+            if len(parts) >= 2:
+                hpo_to_name[parts[0]] = parts[1]
 
-        hpo_terms = []
-        for line in lines:
-            line = line.strip()
-            if line.startswith("HP:"):
-                hpo_terms.append(line)
+    send({"ready": True})
+    for line in sys.stdin:
+        if not line.strip():
+            continue
+        request_id = None
+        try:
+            request = json.loads(line)
+            request_id = request.get("id")
+            terms = [
+                parse_clinphen_output(get_phenotypes.extract_phenotypes(note, hpo_to_name))
+                for note in request["notes"]
+            ]
+            send({"id": request_id, "terms": terms})
+        except Exception as e:
+            send({"id": request_id, "error": f"{type(e).__name__}: {e}"})
+    return 0
 
-        return list(set(hpo_terms))
 
-    except subprocess.CalledProcessError as e:
-        logger.error(f"ClinPhen command failed: {e}")
-        return []
-    except Exception as ex:
-        logger.exception("Error running ClinPhen.")
-        return []
+if __name__ == "__main__":
+    if "--worker" in sys.argv[1:]:
+        sys.exit(_worker_main())
+
+    # Example usage: python real_clinphen.py data/example_record.txt
+    path = sys.argv[1] if len(sys.argv) > 1 else os.path.join("data", "example_record.txt")
+    with open(path) as f:
+        print(run_clinphen(f.read()))
@@ -0,0 +1,92 @@
+# response_cache.py
+"""
+Validators and a bounded cache for the JSON diagnosis API.
+
+A diagnosis depends only on the (normalized) input and on the knowledge base
+the worker loaded, so its ETag is a hash of exactly those two things:
+
+    etag = sha256(knowledge-base version, normalized symptoms, sorted genes)
+
+The knowledge-base version hashes the contents of the data files and the
+settings that change results. It is computed once per process (the knowledge
+base is also loaded once), and workers that loaded the same files agree on it.
+
+ResponseCache keeps serialized responses in LRU order, bounded both by the
+number of entries and by their total size, behind one lock.
+"""
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+
+DEFAULT_MAX_ENTRIES = 1024
+DEFAULT_MAX_BYTES = 32 * 1024 * 1024
+
+
+def normalize_symptoms(text):
+    """
+    Symptom text as it goes into the ETag key. Extraction ignores case and
+    surrounding whitespace, so those don't change the key; whitespace inside
+    the text can change which phrases match, so it is kept.
+    Only used for the key: the diagnosis itself runs on the submitted text.
+    """
+    return (text or "").strip().lower()
+
+
+def knowledge_base_version(paths, settings=None):
+    """Short hex digest of the contents of the existing `paths` plus the `settings` dict."""
+    digest = hashlib.sha256()
+    for path in sorted(paths):
+        digest.update(path.encode("utf-8"))
+        try:
+            with open(path, "rb") as f:
+                for block in iter(lambda: f.read(1 << 20), b""):
+                    digest.update(block)
+        except FileNotFoundError:
+            digest.update(b"<missing>")
+    digest.update(json.dumps(settings or {}, sort_keys=True, default=str).encode("utf-8"))
+    return digest.hexdigest()[:16]
+
+
+def diagnosis_etag(kb_version, symptoms, genes=None):
+    """Strong ETag (quoted) for a normalized symptom text and optional gene list."""
+    key = json.dumps([kb_version, symptoms, sorted(genes) if genes is not None else None])
+    return '"' + hashlib.sha256(key.encode("utf-8")).hexdigest()[:32] + '"'
+
+
+class ResponseCache:
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> bytes, least recently used first
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            body = self._entries.get(key)
+            if body is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return body
+
+    def put(self, key, body):
+        """Stores a serialized response; bodies larger than the whole budget are not cached."""
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old)
+            self._entries[key] = body
+            self._bytes += len(body)
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
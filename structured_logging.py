@@ -0,0 +1,183 @@
+# structured_logging.py
+"""
+Non-blocking JSON-lines logging.
+
+Request threads only put records on an in-memory queue; a background
+QueueListener thread formats them as one JSON object per line and does all
+file I/O, including rotation. If the queue is full (the disk cannot keep up)
+records are dropped and counted rather than blocking the request.
+
+The listener thread belongs to the process that started it, so it is started
+on the first record each process logs. A forked child (e.g. a gunicorn worker
+forked from a preloaded master) drops the queue it inherited, whose lock may
+have been held by the parent's listener at fork time, and starts its own.
+
+Each record carries the current request ID (when logged inside a request) and
+any structured fields passed as extra={"fields": {...}}, e.g. stage timings.
+Free text from users should go through describe_text() so only its length and
+a hash reach the log.
+"""
+import os
+import json
+import time
+import uuid
+import queue
+import atexit
+import hashlib
+import logging
+import datetime
+import threading
+from contextlib import contextmanager
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from flask import g, has_request_context, request
+
+DEFAULT_QUEUE_SIZE = 10_000
+REQUEST_ID_HEADER = "X-Request-ID"
+
+
+def describe_text(text):
+    """Loggable summary of user input: its length and a short SHA-256 digest, never the text."""
+    text = text or ""
+    return {
+        "input_chars": len(text),
+        "input_sha256": hashlib.sha256(text.encode("utf-8")).hexdigest()[:16],
+    }
+
+
+class StageTimer:
+    """Collects wall-clock milliseconds per named stage: `with timer.stage("rank"): ...`."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.timings = {}
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[f"{name}_ms"] = round((time.perf_counter() - start) * 1000, 2)
+
+    def fields(self):
+        return dict(self.timings, total_ms=round((time.perf_counter() - self.started) * 1000, 2))
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        request_id = getattr(record, "request_id", None)
+        if request_id:
+            entry["request_id"] = request_id
+        fields = getattr(record, "fields", None)
+        if fields:
+            entry.update(fields)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class RequestContextFilter(logging.Filter):
+    """Stamps records with the request ID while still on the request thread."""
+
+    def filter(self, record):
+        if not hasattr(record, "request_id"):
+            record.request_id = g.get("request_id") if has_request_context() else None
+        return True
+
+
+class DroppingQueueHandler(QueueHandler):
+    """
+    QueueHandler that never blocks: when the queue is full the record is dropped.
+    It owns the QueueListener feeding `targets`, started on first use in each process.
+    """
+
+    def __init__(self, targets, queue_size=DEFAULT_QUEUE_SIZE):
+        super().__init__(queue.Queue(maxsize=queue_size))
+        self.targets = targets
+        self.queue_size = queue_size
+        self.dropped = 0
+        self.listener = None
+        self._exc_formatter = logging.Formatter()
+        self._start_lock = threading.Lock()
+        os.register_at_fork(after_in_child=self._after_fork)
+        atexit.register(self.stop)
+
+    def _after_fork(self):
+        # The parent's listener thread does not exist in the child
+        self.queue = queue.Queue(maxsize=self.queue_size)
+        self.listener = None
+        self._start_lock = threading.Lock()
+
+    def start(self):
+        if self.listener is None:
+            with self._start_lock:
+                if self.listener is None:
+                    listener = QueueListener(self.queue, *self.targets, respect_handler_level=True)
+                    listener.start()
+                    self.listener = listener
+
+    def stop(self):
+        """Writes out the queued records and stops this process's listener."""
+        listener, self.listener = self.listener, None
+        if listener is not None:
+            listener.stop()
+
+    def prepare(self, record):
+        # Resolve everything that can't cross threads (args, traceback objects) here,
+        # but leave JSON formatting to the listener thread
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = self._exc_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        if self.listener is None:
+            self.start()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def configure_logging(logger, log_file, max_bytes=10 * 1_024 * 1_024, backup_count=5,
+                      level=logging.INFO, queue_size=DEFAULT_QUEUE_SIZE):
+    """
+    Routes `logger` through a bounded queue to a background thread writing
+    JSON lines to a rotating log file. Returns the queue handler.
+    """
+    file_handler = RotatingFileHandler(log_file, maxBytes=max_bytes, backupCount=backup_count)
+    file_handler.setFormatter(JsonFormatter())
+    file_handler.setLevel(level)
+
+    queue_handler = DroppingQueueHandler([file_handler], queue_size)
+    queue_handler.addFilter(RequestContextFilter())
+    queue_handler.setLevel(level)
+
+    logger.addHandler(queue_handler)
+    logger.setLevel(level)
+    return queue_handler
+
+
+def init_request_ids(app):
+    """Gives every request an ID (taken from X-Request-ID if the client sent one) and echoes it back."""
+
+    @app.before_request
+    def assign_request_id():
+        g.request_id = request.headers.get(REQUEST_ID_HEADER) or uuid.uuid4().hex
+
+    @app.after_request
+    def echo_request_id(response):
+        if g.get("request_id"):
+            response.headers[REQUEST_ID_HEADER] = g.request_id
+        return response
@@ -0,0 +1,111 @@
+# term_filter.py
+"""
+Term filtering between HPO extraction and ranking.
+
+Extracted patient sets often contain broad terms ("Abnormality of the
+kidney") whose closures add little information but plenty of intersection
+work. TermFilter shrinks a patient's term list before it reaches the scorer:
+
+1. Terms whose information content is below `min_ic` are dropped.
+2. Terms listed in data/common_phenotypes.txt are dropped (common_weight=0)
+   or kept with a reduced weight (0 < common_weight < 1).
+3. Terms that are ancestors of another kept term are removed: the descendant
+   already implies them, so they only lengthen the list. An ancestor weighted
+   higher than all its kept descendants stays, since dropping it would score
+   its closure at the descendants' lower weight.
+
+If filtering would leave nothing, the unfiltered (collapsed) terms are used so
+a patient always gets a ranking.
+"""
+import os
+import hashlib
+
+DEFAULT_COMMON_PHENOTYPES_PATH = os.path.join("data", "common_phenotypes.txt")
+
+
+def load_common_phenotypes(path=DEFAULT_COMMON_PHENOTYPES_PATH):
+    """Reads one HPO ID per line (blank lines and # comments ignored)."""
+    with open(path, "r") as f:
+        return frozenset(
+            line.strip() for line in f
+            if line.strip() and not line.startswith("#")
+        )
+
+
+class TermFilter:
+    def __init__(self, pipeline, common_terms=(), common_weight=None, min_ic=0.0, collapse_ancestors=True):
+        """
+        pipeline: a PhrankPipeline (provides the ontology closure and information content)
+        common_terms: HPO IDs considered non-specific
+        common_weight: None keeps common terms as they are, 0 drops them,
+            anything in between down-weights their contribution to the score
+        min_ic: terms with a lower information content are dropped
+        collapse_ancestors: remove terms implied by a more specific kept term
+        """
+        self.pipeline = pipeline
+        self.common_terms = frozenset(common_terms)
+        self.common_weight = common_weight
+        self.min_ic = min_ic
+        self.collapse_ancestors = collapse_ancestors
+
+    @classmethod
+    def from_config(cls, pipeline, config):
+        """Builds a filter from the TERM_FILTER_* keys of a Flask config (no-op defaults otherwise)."""
+        common_weight = config.get('TERM_FILTER_COMMON_WEIGHT')
+        path = config.get('TERM_FILTER_COMMON_PATH', DEFAULT_COMMON_PHENOTYPES_PATH)
+        common_terms = load_common_phenotypes(path) if common_weight is not None and os.path.exists(path) else ()
+        return cls(
+            pipeline,
+            common_terms=common_terms,
+            common_weight=common_weight,
+            min_ic=config.get('TERM_FILTER_MIN_IC', 0.0),
+            collapse_ancestors=config.get('TERM_FILTER_COLLAPSE_ANCESTORS', True),
+        )
+
+    def settings(self):
+        """The filter's settings as plain values, recorded with score tables built through it."""
+        common_terms = "\n".join(sorted(self.common_terms)) if self.common_weight is not None else ""
+        return {
+            "common_weight": self.common_weight,
+            "common_terms": hashlib.sha256(common_terms.encode("utf-8")).hexdigest()[:16],
+            "min_ic": self.min_ic,
+            "collapse_ancestors": self.collapse_ancestors,
+        }
+
+    def information_content(self, term):
+        """IC of a term (-log of the fraction of diseases annotated with it or a descendant)."""
+        return self.pipeline.information_content.get(term, 0)
+
+    def _collapse(self, terms, term_weights):
+        # Ancestor -> the highest weight among the kept terms below it
+        implied = {}
+        for term in terms:
+            weight = term_weights.get(term, 1.0)
+            for ancestor in self.pipeline.term_closure([term]) - {term}:
+                if weight > implied.get(ancestor, 0):
+                    implied[ancestor] = weight
+        return [t for t in terms if t not in implied or term_weights.get(t, 1.0) > implied[t]]
+
+    def apply(self, hpo_terms):
+        """
+        Returns (terms, term_weights): the filtered term list, and a dict of
+        term -> weight for the down-weighted terms (empty when none are).
+        """
+        terms = list(dict.fromkeys(hpo_terms))
+        kept, term_weights = [], {}
+        for term in terms:
+            if self.min_ic and self.information_content(term) < self.min_ic:
+                continue
+            if self.common_weight is not None and term in self.common_terms:
+                if self.common_weight <= 0:
+                    continue
+                if self.common_weight < 1:
+                    term_weights[term] = self.common_weight
+            kept.append(term)
+
+        if not kept:
+            kept, term_weights = terms, {}
+        if self.collapse_ancestors:
+            kept = self._collapse(kept, term_weights)
+            term_weights = {t: w for t, w in term_weights.items() if t in kept}
+        return kept, term_weights
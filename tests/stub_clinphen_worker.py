@@ -0,0 +1,42 @@
+# tests/stub_clinphen_worker.py
+"""
+Stand-in ClinPhen worker speaking the real_clinphen.py protocol, for tests.
+
+Every note gets one fake term, HP:<7-digit note length>, except:
+  "crash"  the worker exits without answering
+  "hang"   the worker never answers
+
+Options:
+  --not-ready          refuse to start
+  --crash-once PATH    crash on the first request if PATH does not exist yet
+                       (and create it), so only the first worker fails
+"""
+import sys
+import json
+import time
+import os
+
+
+def main(argv):
+    if "--not-ready" in argv:
+        print(json.dumps({"ready": False, "error": "stub told not to start"}), flush=True)
+        return 1
+    crash_once = argv[argv.index("--crash-once") + 1] if "--crash-once" in argv else None
+
+    print(json.dumps({"ready": True}), flush=True)
+    for line in sys.stdin:
+        request = json.loads(line)
+        if crash_once and not os.path.exists(crash_once):
+            open(crash_once, "w").close()
+            return 1
+        if "crash" in request["notes"]:
+            return 1
+        if "hang" in request["notes"]:
+            time.sleep(3600)
+        terms = [[f"HP:{len(note):07d}"] for note in request["notes"]]
+        print(json.dumps({"id": request["id"], "terms": terms}), flush=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
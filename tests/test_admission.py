@@ -0,0 +1,122 @@
+# tests/test_admission.py
+import os
+import sys
+import sqlite3
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import admission  # noqa: E402
+from admission import AdmissionController, Rejected  # noqa: E402
+
+SHORT, LONG = 100, 100_000
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(admission.time, "time", clock)
+    return clock
+
+
+def rejected_status(controller, user_id, request_bytes):
+    with pytest.raises(Rejected) as info:
+        controller.admit(user_id, request_bytes)
+    return info.value.status
+
+
+def test_tokens_refill_at_the_configured_rate(clock):
+    controller = AdmissionController(rate_per_minute=60, burst=2, max_in_flight=10)
+    for _ in range(2):
+        controller.release(controller.admit(1, SHORT))
+    with pytest.raises(Rejected) as info:
+        controller.admit(1, SHORT)
+    assert info.value.status == 429
+    assert info.value.retry_after == 1
+
+    clock.now += 1.0  # one token per second
+    controller.release(controller.admit(1, SHORT))
+    assert rejected_status(controller, 1, SHORT) == 429
+    # Other users have their own bucket
+    controller.release(controller.admit(2, SHORT))
+
+
+def test_no_rate_limit(clock):
+    controller = AdmissionController(rate_per_minute=None, burst=1, max_in_flight=10)
+    for _ in range(20):
+        controller.release(controller.admit(1, SHORT))
+
+
+def test_reserved_slot_is_kept_for_short_requests(clock):
+    controller = AdmissionController(rate_per_minute=None, max_in_flight=3, reserved_short_slots=1)
+    long_slots = [controller.admit(1, LONG), controller.admit(2, LONG)]
+    assert rejected_status(controller, 3, LONG) == 503
+    # Unknown length counts as long
+    assert rejected_status(controller, 3, None) == 503
+
+    short_slot = controller.admit(3, SHORT)
+    assert rejected_status(controller, 4, SHORT) == 503
+    assert controller.in_flight == 3
+
+    controller.release(short_slot)
+    controller.release(long_slots[0])
+    controller.release(controller.admit(4, LONG))
+    controller.release(long_slots[1])
+    assert controller.in_flight == 0
+
+
+def test_shed_request_keeps_its_token(clock):
+    controller = AdmissionController(rate_per_minute=60, burst=1, max_in_flight=1, reserved_short_slots=0)
+    slot = controller.admit(1, SHORT)
+    # Rejected for capacity: the transaction is rolled back, so user 2's token is not spent
+    assert rejected_status(controller, 2, SHORT) == 503
+    controller.release(slot)
+    controller.release(controller.admit(2, SHORT))
+    assert rejected_status(controller, 2, SHORT) == 429
+
+
+def test_oversized_requests_and_inputs(clock):
+    controller = AdmissionController(rate_per_minute=60, burst=1, max_input_chars=10, max_request_bytes=1000)
+    assert rejected_status(controller, 1, 1001) == 413
+    # A 413 spends no token and takes no slot
+    slot = controller.admit(1, 1000)
+    assert controller.in_flight == 1
+    with pytest.raises(Rejected) as info:
+        controller.check_input(11)
+    assert info.value.status == 413
+    controller.check_input(10)
+    controller.release(slot)
+
+
+def test_locked_state_sheds_instead_of_waiting(tmp_path, clock):
+    path = str(tmp_path / "admission.sqlite")
+    controller = AdmissionController(rate_per_minute=None, state_path=path, busy_timeout=0.05)
+    controller.release(controller.admit(1, SHORT))
+
+    other = sqlite3.connect(path, isolation_level=None)
+    other.execute("BEGIN IMMEDIATE")
+    try:
+        assert rejected_status(controller, 1, SHORT) == 503
+    finally:
+        other.execute("ROLLBACK")
+        other.close()
+    controller.release(controller.admit(1, SHORT))
+    assert controller.in_flight == 0
+
+
+def test_slots_are_shared_through_the_state_file(tmp_path, clock):
+    path = str(tmp_path / "admission.sqlite")
+    first = AdmissionController(rate_per_minute=None, max_in_flight=1, reserved_short_slots=0, state_path=path)
+    second = AdmissionController(rate_per_minute=None, max_in_flight=1, reserved_short_slots=0, state_path=path)
+    slot = first.admit(1, SHORT)
+    assert rejected_status(second, 2, SHORT) == 503
+    first.release(slot)
+    second.release(second.admit(2, SHORT))
@@ -0,0 +1,71 @@
+# tests/test_clinphen_pool.py
+import os
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from real_clinphen import ClinPhenPool  # noqa: E402
+
+STUB = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "stub_clinphen_worker.py")]
+
+
+def fallback(note):
+    return ["fallback"]
+
+
+@pytest.fixture
+def make_pool():
+    pools = []
+
+    def make(command=STUB, **kwargs):
+        kwargs.setdefault("size", 1)
+        kwargs.setdefault("timeout", 5.0)
+        kwargs.setdefault("startup_timeout", 10.0)
+        pool = ClinPhenPool(command, fallback=fallback, **kwargs)
+        pools.append(pool)
+        return pool
+
+    yield make
+    for pool in pools:
+        pool.close()
+
+
+def test_batches_round_trip(make_pool):
+    pool = make_pool(batch_size=2)
+    notes = ["a", "bb", "ccc", "dddd", "eeeee"]
+    assert pool.extract_batch(notes) == [[f"HP:{len(n):07d}"] for n in notes]
+
+
+def test_crashed_worker_is_restarted(make_pool, tmp_path):
+    pool = make_pool(STUB + ["--crash-once", str(tmp_path / "crashed")])
+    assert pool.extract("abc") == ["HP:0000003"]
+    assert (tmp_path / "crashed").exists()
+
+
+def test_note_that_always_crashes_falls_back_and_pool_recovers(make_pool):
+    pool = make_pool()
+    assert pool.extract("crash") == ["fallback"]
+    assert pool.extract("ok") == ["HP:0000002"]
+
+
+def test_hung_worker_times_out_and_falls_back(make_pool):
+    timeout = 0.5
+    pool = make_pool(timeout=timeout)
+    started = time.monotonic()
+    assert pool.extract("hang") == ["fallback"]
+    # Documented bound: two attempts plus the replacement worker's start-up
+    assert time.monotonic() - started < 2 * timeout + pool.startup_timeout
+    assert pool.extract("ok") == ["HP:0000002"]
+
+
+def test_worker_that_cannot_start_falls_back(make_pool):
+    assert make_pool(STUB + ["--not-ready"]).extract("abc") == ["fallback"]
+    assert make_pool(["/nonexistent/clinphen-worker"]).extract("abc") == ["fallback"]
+
+
+def test_closed_pool_uses_fallback(make_pool):
+    pool = make_pool()
+    pool.close()
+    assert pool.extract_batch(["a", "b"]) == [["fallback"], ["fallback"]]
@@ -0,0 +1,65 @@
+# tests/test_phrank_pipeline.py
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from phrank_pipeline import PhrankPipeline  # noqa: E402
+
+# A small DAG in the space-separated layout of data/hp_dag.txt
+DAG = """\
+HP:0000118 HP:0000001
+HP:0000707 HP:0000118
+HP:0000478 HP:0000118
+HP:0001250 HP:0000707
+HP:0002373 HP:0001250
+HP:0001263 HP:0000707
+HP:0000504 HP:0000478
+HP:0000505 HP:0000504
+HP:0000486 HP:0000504
+HP:0000486 HP:0000478
+"""
+
+DISEASES = {
+    "ORPHA:1 | Epilepsy syndrome": {"hpo_terms": ["HP:0002373", "HP:0001263"]},
+    "ORPHA:2 | Visual disorder": {"hpo_terms": ["HP:0000505"]},
+    "ORPHA:3 | Strabismus syndrome": {"hpo_terms": ["HP:0000486", "HP:0001250"]},
+    "ORPHA:4 | Developmental delay": {"hpo_terms": ["HP:0001263"]},
+}
+
+PATIENTS = [
+    ["HP:0002373"],
+    ["HP:0001250", "HP:0000505"],
+    ["HP:0000486", "HP:0001263", "HP:0002373"],
+    ["HP:0000118"],
+    ["HP:9999999"],
+]
+
+
+@pytest.fixture
+def pipeline(tmp_path):
+    dag_file = tmp_path / "hp_dag.txt"
+    dag_file.write_text(DAG)
+    return PhrankPipeline(str(dag_file), DISEASES)
+
+
+def test_information_content_is_computed(pipeline):
+    ic = pipeline.information_content
+    assert ic["HP:0000001"] == 0
+    assert ic["HP:0001263"] == pytest.approx(1.0)  # two of four diseases
+
+
+@pytest.mark.parametrize("patient", PATIENTS)
+def test_score_all_matches_phrank(pipeline, patient):
+    scores = pipeline.score_all(patient)
+    for row, disease_key in enumerate(pipeline.disease_keys):
+        expected = pipeline.phrank.compute_phenotype_match(patient, DISEASES[disease_key]["hpo_terms"])
+        assert scores[row] == pytest.approx(expected, abs=1e-6)
+
+
+def test_rank_diseases_orders_by_score(pipeline):
+    results, is_rare = pipeline.rank_diseases(["HP:0002373", "HP:0001263"])
+    assert results[0][0] == "ORPHA:1 | Epilepsy syndrome"
+    assert [score for _, score in results] == sorted((score for _, score in results), reverse=True)
+    assert not is_rare
@@ -0,0 +1,134 @@
+# vcf_genes.py
+"""
+Streaming gene-set extraction from (optionally bgzipped) VCF files.
+
+The file is read one line at a time and only the set of gene IDs is kept, so
+memory stays bounded by the number of distinct genes rather than the size of
+the VCF. Gene names are taken from INFO annotation fields:
+
+    ANN       snpEff annotations, sub-field chosen by name (default Gene_ID)
+    CSQ       VEP annotations, sub-field chosen by name (default Gene)
+    GENEINFO  dbSNP style "SYMBOL:ENTREZ|SYMBOL:ENTREZ"
+    anything else is read as a plain comma-separated list of gene names
+
+The sub-field positions of ANN/CSQ are read from the VCF header. An optional
+two-column mapping file (same format as phrank.utils.load_gene_symbol_map)
+translates the annotated names into the gene IDs used by the knowledge base.
+"""
+import io
+import re
+import gzip
+import logging
+from phrank.utils import load_gene_symbol_map
+
+logger = logging.getLogger(__name__)
+
+# field -> sub-field to take from each annotation entry (None for simple fields)
+DEFAULT_ANNOTATION_FIELDS = {"ANN": "Gene_ID", "CSQ": "Gene", "GENEINFO": None}
+
+# e.g. ##INFO=<ID=CSQ,...,Description="Consequence annotations from Ensembl VEP. Format: Allele|Consequence|...">
+#      ##INFO=<ID=ANN,...,Description="Functional annotations: 'Allele | Annotation | ...' ">
+_HEADER_FORMAT = re.compile(r"##INFO=<ID=(\w+),.*Description=\".*?(?:Format|annotations):\s*'?([^'\"]+)'?\s*\"")
+
+
+def open_vcf(source):
+    """
+    Opens a VCF path or binary file object for line-by-line text reading,
+    transparently decompressing gzip/bgzip input (detected from the magic bytes).
+    """
+    if isinstance(source, (str, bytes)) or hasattr(source, "__fspath__"):
+        source = open(source, "rb")
+    head = source.read(2)
+    source.seek(0)
+    if head == b"\x1f\x8b":
+        source = gzip.GzipFile(fileobj=source)
+    return io.TextIOWrapper(source, encoding="utf-8", errors="replace")
+
+
+def load_gene_mapping(path, invert=False):
+    """
+    Reads a two-column tab-separated mapping file. By default the first column
+    is the annotated name and the second the knowledge-base gene ID; pass
+    invert=True for files laid out the other way round (e.g. gene ID -> symbol).
+    """
+    mapping = load_gene_symbol_map(path)
+    if invert:
+        mapping = {v: k for k, v in mapping.items()}
+    return mapping
+
+
+def _parse_header_formats(line, formats):
+    match = _HEADER_FORMAT.match(line)
+    if match:
+        columns = [c.strip() for c in match.group(2).split("|")]
+        formats[match.group(1)] = {name: i for i, name in enumerate(columns)}
+
+
+def _genes_from_info(info, fields, formats):
+    genes = set()
+    for entry in info.split(";"):
+        key, _, value = entry.partition("=")
+        if key not in fields or not value:
+            continue
+        sub_field = fields[key]
+        if key == "GENEINFO":
+            genes.update(g.split(":")[0] for g in value.split("|"))
+        elif sub_field is not None:
+            column = formats.get(key, {}).get(sub_field)
+            if column is None:
+                continue
+            for annotation in value.split(","):
+                parts = annotation.split("|")
+                if column < len(parts) and parts[column]:
+                    genes.add(parts[column])
+        else:
+            genes.update(g for g in value.split(",") if g)
+    return genes
+
+
+def genes_from_vcf(source, fields=None, mapping=None, pass_only=False):
+    """
+    Returns the set of gene IDs annotated on the variants of a VCF.
+
+    fields:    {INFO field: sub-field} to read (default DEFAULT_ANNOTATION_FIELDS)
+    mapping:   optional dict translating annotated names into knowledge-base IDs;
+               names missing from the mapping are dropped
+    pass_only: skip variants whose FILTER is not PASS or "."
+    """
+    fields = DEFAULT_ANNOTATION_FIELDS if fields is None else fields
+    formats = {}
+    genes = set()
+    variants = 0
+
+    with open_vcf(source) as vcf:
+        for line in vcf:
+            if line.startswith("##"):
+                _parse_header_formats(line, formats)
+                continue
+            if line.startswith("#"):
+                continue
+
+            columns = line.rstrip("\n").split("\t", 8)
+            if len(columns) < 8:
+                continue
+            if pass_only and columns[6] not in ("PASS", "."):
+                continue
+            variants += 1
+            genes |= _genes_from_info(columns[7], fields, formats)
+
+    if mapping is not None:
+        genes = {mapping[g] for g in genes if g in mapping}
+    logger.info(f"Read {variants} variants, {len(genes)} candidate genes.")
+    return genes
+
+
+if __name__ == "__main__":
+    import sys
+    if len(sys.argv) < 2:
+        print("Usage: python vcf_genes.py <file.vcf[.gz]> [mapping.txt]")
+        sys.exit(1)
+    mapping = load_gene_mapping(sys.argv[2]) if len(sys.argv) > 2 else None
+    genes = genes_from_vcf(sys.argv[1], mapping=mapping)
+    print(f"{len(genes)} genes")
+    for gene in sorted(genes):
+        print(gene)